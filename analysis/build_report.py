@@ -0,0 +1,119 @@
+import os
+import sys
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'notebooks'))
+
+from utilities import (load_csv, load_compiled_codelist, CodelistIndex, create_child_table, UsageCube,
+                       calculate_statistics_practices, calculate_statistics_demographics, get_percentiles)
+from measure_loader import load_measure_frames, measure_path
+from study_parser import load_measures, STUDY_DEFINITION
+from compile_codelists import compiled_codelist_path
+from report_store import input_key, read_manifest, write_report, REPORT_DIR
+from fingerprint import source_files
+from perf import stage, enable, report_path
+
+# Computes every table, statistic and figure frame shown in
+# notebooks/pulse_oximetry_SRO.ipynb once, headless, and stores them with
+# report_store. The notebook only loads and displays them. Nothing is
+# recomputed while the measure files, practice count, codelist and this code
+# are unchanged:
+#
+#   python analysis/build_report.py
+
+# this script and every local module it imports, found transitively, plus the study definition
+CODE = [os.path.relpath(path) for path in source_files([__file__])] + [STUDY_DEFINITION]
+
+# demographic breakdowns shown in the notebook, with the end date of their windows
+DEMOGRAPHICS = {
+    "by_region": ("region", "2021-01-01"),
+    "by_age_band": ("age_band", "2021-01-01"),
+    "by_sex": ("sex", "2021-02-01"),
+}
+PRACTICES_END_DATE = "2020-01-01"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Precompute the notebook tables and figure data")
+    parser.add_argument('--measures-dir', default='output/measures')
+    parser.add_argument('--practice-count', default='output/input_practice_count.csv')
+    parser.add_argument('--output-dir', default=REPORT_DIR)
+    parser.add_argument('--force', action='store_true', help="rebuild even if the inputs are unchanged")
+    parser.add_argument('--perf-report', nargs='?', const=report_path('build_report'), default=None,
+                        help="record the time and peak memory of each stage in this JSON report")
+    return parser.parse_args()
+
+
+def usage_cube_path(measures_dir):
+    return os.path.join(measures_dir, 'usage_cube.npz')
+
+
+def report_inputs(measures, measures_dir, practice_count):
+    return ([measure_path(m, measures_dir) for m in measures] + [usage_cube_path(measures_dir), practice_count]
+            + [compiled_codelist_path('pulse-oximetry')] + CODE)
+
+
+def build_report(measures, measures_dir, practice_count):
+    """Returns (frames, values) making up the report."""
+    # sorted by date, small numbers redacted and rates per 1000
+    frames = load_measure_frames(measures, measures_dir, redact=5)
+    report_frames = {}
+    values = {}
+
+    # child codes are slices of the usage cube. Both tables sum the same redacted region cells. Every
+    # month with a suppressed cell hides at least two cells in that code and in that region, so the
+    # event code and region totals published alongside them only reveal sums of several hidden cells
+    cube = UsageCube.load(usage_cube_path(measures_dir))
+    codelist_index = CodelistIndex(load_compiled_codelist('pulse-oximetry'), code_column='CTV3ID', term_column='term')
+    report_frames['child_table'] = create_child_table(
+        df=cube, code_df=codelist_index, code_column='CTV3ID', term_column='term', measure='had_pulse_ox',
+        redact=5, dimension='region')
+    report_frames['code_by_region'] = cube.by_dimension('region', redact=5)
+
+    event_code = frames['had_pulse_ox_event_code']
+    event_code['had_pulse_ox_event_code'] = event_code['had_pulse_ox_event_code'].astype(str)
+
+    practices = frames['had_pulse_ox_practice_only']
+    practice_df = load_csv(practice_count, columns=['practice'])
+    values['practices'] = calculate_statistics_practices(practices, practice_df, PRACTICES_END_DATE)
+    report_frames['deciles'] = get_percentiles(
+        practices, period_column='date', column='had_pulse_ox', show_outer_percentiles=False)
+
+    region = frames['had_pulse_ox_by_region']
+    region['region'] = region['region'].astype('category').cat.add_categories('NA').fillna('NA')
+    for name, (variable, end_date) in DEMOGRAPHICS.items():
+        report_frames[f'{name}_counts'] = calculate_statistics_demographics(
+            df=frames[f'had_pulse_ox_{name}'], demographic_var=variable, end_date=end_date,
+            event_column='had_pulse_ox')
+
+    # figure data, the practice level frame is only needed for the tables above
+    for name in ['total', 'event_code', 'by_region', 'by_age_band', 'by_sex']:
+        report_frames[name] = frames[f'had_pulse_ox_{name}']
+
+    return report_frames, _to_json(values)
+
+
+def _to_json(value):
+    if isinstance(value, dict):
+        return {key: _to_json(v) for key, v in value.items()}
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.perf_report:
+        enable(args.perf_report)
+
+    measures = load_measures()
+    key = input_key(report_inputs(measures, args.measures_dir, args.practice_count))
+
+    if not args.force and read_manifest(args.output_dir)["key"] == key:
+        print(f"report in {args.output_dir} is up to date")
+        sys.exit()
+
+    with stage("build_report"):
+        frames, values = build_report(measures, args.measures_dir, args.practice_count)
+    write_report(args.output_dir, key, frames, values)
@@ -0,0 +1,39 @@
+import pandas as pd
+
+
+def as_code_strings(codes):
+    """
+    Returns `codes` as strings. Numeric SNOMED codes read as floats (because of
+    missing values) are converted back to their integer form first.
+    """
+    codes = pd.Series(codes)
+    if pd.api.types.is_float_dtype(codes):
+        codes = codes.astype('Int64')
+    return codes.astype(str)
+
+
+class CodelistIndex:
+    """
+    Hash index from code (SNOMED or CTV3) to term, built once per codelist so
+    descriptions are looked up with a vectorised map instead of a scan per code.
+    """
+
+    def __init__(self, code_df, code_column, term_column):
+        terms = pd.Series(code_df[term_column].to_numpy(), index=as_code_strings(code_df[code_column]).to_numpy())
+        self.terms = terms[~terms.index.duplicated()]
+        self.code_column = code_column
+        self.term_column = term_column
+
+    @classmethod
+    def from_csv(cls, path, code_column, term_column):
+        return cls(pd.read_csv(path, dtype={code_column: str}), code_column, term_column)
+
+    def __contains__(self, code):
+        return str(code) in self.terms.index
+
+    def __len__(self):
+        return len(self.terms)
+
+    def describe(self, codes, missing=""):
+        """Returns the term for each of `codes`, or `missing` where it is not in the codelist."""
+        return as_code_strings(codes).map(self.terms).fillna(missing)
@@ -0,0 +1,118 @@
+import os
+import sys
+import json
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    # without pyarrow every load falls back to parsing the CSV
+    pa = None
+    feather = None
+
+from perf import timed
+from schema import schema_for
+
+# Typed feather copies of the cohort extracts and measure files, written next to
+# each CSV (input_2020-07-01.csv -> input_2020-07-01.feather). A cache is only
+# used while the size and mtime of its CSV, and the schema it was typed with,
+# match the ones recorded when it was written. Column dtypes come from schema.py.
+
+CHUNKSIZE = 1_000_000
+
+
+def cache_path(csv_path):
+    return os.path.splitext(csv_path)[0] + '.feather'
+
+
+def _source_fingerprint(csv_path):
+    stat = os.stat(csv_path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime, "schema": schema_for(csv_path).key}
+
+
+def is_fresh(csv_path):
+    """Checks the cache for `csv_path` exists and was written from the current CSV."""
+    path = cache_path(csv_path)
+    if feather is None or not os.path.exists(path):
+        return False
+
+    with pa.memory_map(path) as source:
+        metadata = pa.ipc.open_file(source).schema.metadata or {}
+    if b'source' not in metadata:
+        return False
+    return json.loads(metadata[b'source']) == _source_fingerprint(csv_path)
+
+
+def read_csv_typed(csv_path, columns=None, chunksize=None):
+    """
+    Reads `csv_path` with the schema dtypes applied at parse time. Returns a
+    DataFrame, or an iterator of DataFrames if `chunksize` is given.
+    """
+    schema = schema_for(csv_path)
+    header = pd.read_csv(csv_path, nrows=0).columns
+    if columns is not None:
+        header = [column for column in header if column in columns]
+
+    reader = pd.read_csv(csv_path, usecols=header, dtype=schema.dtypes(header),
+                         parse_dates=schema.date_columns(header), chunksize=chunksize)
+    if chunksize is None:
+        return schema.finalise(reader)
+    return (schema.finalise(chunk) for chunk in reader)
+
+
+def convert(csv_path):
+    """Writes the typed feather cache for `csv_path` and returns the loaded frame."""
+    df = read_csv_typed(csv_path)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[b'source'] = json.dumps(_source_fingerprint(csv_path)).encode()
+    feather.write_feather(table.replace_schema_metadata(metadata), cache_path(csv_path),
+                          chunksize=CHUNKSIZE)
+    return df
+
+
+@timed("load")
+def load_csv(csv_path, columns=None):
+    """
+    Loads `csv_path` from its feather cache when it is fresh, otherwise from the
+    CSV itself. Only `columns` are read if given.
+    """
+    if is_fresh(csv_path):
+        return feather.read_feather(cache_path(csv_path), columns=columns)
+    return read_csv_typed(csv_path, columns=columns)
+
+
+def iter_csv(csv_path, columns=None, chunksize=CHUNKSIZE):
+    """
+    Yields `csv_path` as DataFrames of at most `chunksize` rows, from the record
+    batches of a fresh cache or from chunked CSV reads otherwise.
+    """
+    if not is_fresh(csv_path):
+        yield from read_csv_typed(csv_path, columns=columns, chunksize=chunksize)
+        return
+
+    with pa.memory_map(cache_path(csv_path)) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            if columns is not None:
+                batch = batch.select([c for c in batch.schema.names if c in columns])
+            for offset in range(0, batch.num_rows, chunksize):
+                yield batch.slice(offset, chunksize).to_pandas()
+
+
+def convert_directory(directory):
+    """Converts every stale extract and measure CSV in `directory`."""
+    for file in sorted(os.listdir(directory)):
+        if file.endswith('.csv') and file.startswith(('input_', 'measure_')):
+            csv_path = os.path.join(directory, file)
+            if not is_fresh(csv_path):
+                convert(csv_path)
+
+
+if __name__ == "__main__":
+    if feather is None:
+        sys.exit("pyarrow is required to build the columnar cache")
+    for directory in sys.argv[1:] or ['output/measures']:
+        convert_directory(directory)
@@ -0,0 +1,115 @@
+import os
+import sys
+import json
+import hashlib
+import pandas as pd
+
+# Compiles codelists that need extra columns (such as a SNOMED -> CTV3 mapping)
+# into versioned, content-hashed CSVs under codelists/compiled. The study
+# definition and the notebook read these read-only; re-run this script after
+# updating a codelist or mapping:
+#
+#   python analysis/compile_codelists.py
+#
+# and use --check to fail if a compiled codelist is out of date.
+
+COMPILED_DIR = 'codelists/compiled'
+MANIFEST = os.path.join(COMPILED_DIR, 'manifest.json')
+VERSION = 1
+
+pulse_ox_code_mapping = {"1325251000000106": "Y2a44",
+                         "1325261000000109": "Y2a45",
+                         "1325271000000102": "Y2a46",
+                         "1325201000000105": "Y2a47",
+                         "1325191000000108": "Y2a48",
+                         "1325221000000101": "Y2a49",
+                         "1325241000000108": "Y2a4a",
+                         "1325281000000100": "Y2a4b",
+                         "1325681000000102": "Y2b97",
+                         "1325701000000100": "Y2b98",
+                         "1325691000000100": "Y2b99",
+                         "1325211000000107": "YA796"
+                         }
+
+CODELISTS = {
+    "pulse-oximetry": {
+        "source": "codelists/opensafely-pulse-oximetry.csv",
+        "code_column": "code",
+        "mapped_column": "CTV3ID",
+        "mapping": pulse_ox_code_mapping,
+    },
+}
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def compile_codelist(name, spec):
+    """Returns (compiled csv bytes, manifest entry) for the codelist `name`."""
+    with open(spec["source"], 'rb') as f:
+        source = f.read()
+    mapping = json.dumps(spec["mapping"], sort_keys=True).encode()
+
+    df = pd.read_csv(spec["source"], dtype=str)
+    df[spec["mapped_column"]] = df[spec["code_column"]].map(spec["mapping"])
+    unmapped = df[spec["code_column"]][df[spec["mapped_column"]].isna()]
+    if len(unmapped):
+        raise ValueError(f"{name}: no mapping for codes {', '.join(unmapped)}")
+
+    compiled = df.to_csv(index=False).encode()
+    digest = _sha256(compiled)
+    entry = {
+        "version": VERSION,
+        "path": f'{COMPILED_DIR}/{name}-v{VERSION}-{digest[:12]}.csv',
+        "sha256": digest,
+        "source": spec["source"],
+        "source_sha256": _sha256(source),
+        "mapping_sha256": _sha256(mapping),
+    }
+    return compiled, entry
+
+
+def read_manifest(root='.'):
+    path = os.path.join(root, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def compiled_codelist_path(name, root='.'):
+    """Returns the path of the compiled codelist `name`, relative to `root`."""
+    return os.path.join(root, read_manifest(root)[name]["path"])
+
+
+def load_compiled_codelist(name, root='.'):
+    """Loads the compiled codelist `name` with every column as strings."""
+    return pd.read_csv(compiled_codelist_path(name, root), dtype=str)
+
+
+if __name__ == "__main__":
+    check = '--check' in sys.argv[1:]
+    manifest = read_manifest()
+
+    stale = []
+    for name, spec in CODELISTS.items():
+        compiled, entry = compile_codelist(name, spec)
+        if manifest.get(name) == entry and os.path.exists(entry["path"]):
+            continue
+        stale.append(name)
+        if not check:
+            os.makedirs(COMPILED_DIR, exist_ok=True)
+            if name in manifest and os.path.exists(manifest[name]["path"]):
+                os.remove(manifest[name]["path"])
+            with open(entry["path"], 'wb') as f:
+                f.write(compiled)
+            manifest[name] = entry
+
+    if check:
+        if stale:
+            sys.exit(f"compiled codelists out of date: {', '.join(stale)}")
+    elif stale:
+        with open(MANIFEST, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+            f.write('\n')
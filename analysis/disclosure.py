@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+
+from perf import timed
+
+# Statistical disclosure control for measure frames: small number suppression,
+# secondary suppression within each published total and rounding to the nearest N.
+
+
+def _secondary_suppression(df, mask, column, by=('date',)):
+    """
+    Where exactly one group is suppressed within the rows sharing `by` (a date,
+    or a date and the leading group_by columns), it can be recovered from their
+    total, so the group with the smallest `column` among them is suppressed too.
+    Groups whose `column` is already missing are hidden and never picked.
+    """
+    keys = [df[c] for c in by]
+    suppressed_per_total = mask.groupby(keys, dropna=False, observed=True).transform('sum')
+    candidates = ~mask & (suppressed_per_total == 1) & df[column].notna()
+    if not candidates.any():
+        return mask
+
+    candidate_keys = [k[candidates] for k in keys]
+    smallest = df.loc[candidates, column].groupby(candidate_keys, dropna=False, observed=True).idxmin()
+    mask = mask.copy()
+    mask.loc[smallest.to_numpy()] = True
+    return mask
+
+
+def _suppress_margins(df, mask, column, margins):
+    """
+    Secondary suppression within each of `margins`, lists of the columns of the
+    published totals. Suppressing a group for one margin can leave a single
+    suppressed group in another, so it is repeated until none changes.
+    """
+    while True:
+        before = mask
+        for by in margins:
+            mask = _secondary_suppression(df, mask, column, by)
+        if mask.equals(before):
+            return mask
+
+
+def round_to_nearest(df, columns, base=5):
+    """Rounds `columns` of `df` to the nearest multiple of `base`, in place."""
+    for column in columns:
+        df[column] = (df[column] / base).round() * base
+    return df
+
+
+@timed("redaction")
+def redact_small_numbers(frames, n, measures, rounding=None, margins=None):
+    """
+    Takes measure frames and converts the numerator, denominator and value to nan
+    where the numerator or denominator of measure m is equal to or below n.
+    For grouped measures, a second group is suppressed wherever only one is
+    suppressed among the groups sharing a date (and the leading group_by values).
+    Other published totals are given as `margins`, lists of the columns they
+    are grouped by, e.g. [['date', 'code'], ['date', 'region']].
+    If `rounding` is given, the remaining counts are rounded to the nearest
+    multiple of it and the value recalculated.
+    Frames are modified in place; accepts a single frame and measure or lists of each.
+    """
+    if isinstance(frames, pd.DataFrame):
+        redact_small_numbers([frames], n, [measures], rounding, margins)
+        return frames
+
+    for df, m in zip(frames, measures):
+        columns = [m.numerator, m.denominator, 'value']
+
+        mask = (df[m.numerator] <= n) | (df[m.denominator] <= n)
+        if m.group_by:
+            mask = _suppress_margins(df, mask, m.numerator, margins or [['date'] + list(m.group_by[:-1])])
+
+        for column in columns:
+            df[column] = df[column].where(~mask, np.nan)
+
+        if rounding:
+            round_to_nearest(df, [m.numerator, m.denominator], rounding)
+            df['value'] = df[m.numerator] / df[m.denominator]
+
+    return frames
@@ -0,0 +1,184 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+from study_parser import load_study_variables, STUDY_DEFINITION
+
+# Generates large dummy extracts locally from the return_expectations of a study
+# definition, sampling each column for a whole batch of patients at once:
+#
+#   python analysis/dummy_data.py --population 10000000 \
+#       --index-date-range "2020-07-01 to 2021-01-01 by month" --output-dir output/measures
+#   python analysis/dummy_data.py --study-definition analysis/study_definition_practice_count.py \
+#       --output output/input_practice_count.csv
+
+# share of the population in each 10 year age band, used for "population_ages"
+POPULATION_AGES = {
+    (0, 10): 0.12, (10, 20): 0.115, (20, 30): 0.13, (30, 40): 0.13, (40, 50): 0.13,
+    (50, 60): 0.135, (60, 70): 0.11, (70, 80): 0.085, (80, 90): 0.04, (90, 100): 0.005,
+}
+
+# growth of "exponential_increase" dates across the date range
+EXPONENTIAL_RATE = 3.0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Generate dummy extracts from the return_expectations of a study definition")
+    parser.add_argument('--study-definition', default=STUDY_DEFINITION)
+    parser.add_argument('--population', type=int, default=10000)
+    parser.add_argument('--index-date-range', default=None,
+                        help='e.g. "2020-07-01 to 2021-01-01 by month"; writes input_<date>.csv per index date')
+    parser.add_argument('--output-dir', default='output/measures')
+    parser.add_argument('--output', default='output/input.csv',
+                        help="extract written when there is no index date range")
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--columnar-cache', action='store_true',
+                        help="also write the feather cache next to each extract")
+    return parser.parse_args()
+
+
+def parse_index_date_range(index_date_range):
+    """Parses cohortextractor's "<start> to <end> by <month|week>" into a list of ISO dates."""
+    dates, period = index_date_range.split(' by ')
+    start, end = dates.split(' to ')
+    freq = {'month': 'MS', 'week': '7D'}[period.strip()]
+    return list(pd.date_range(start.strip(), end.strip(), freq=freq).strftime('%Y-%m-%d'))
+
+
+def _sample_categories(rng, n, ratios):
+    categories = list(ratios)
+    p = np.array([ratios[c] for c in categories], dtype=np.float64)
+    codes = np.searchsorted(np.cumsum(p / p.sum()), rng.random(n), side='right')
+    return np.minimum(codes, len(categories) - 1).astype(np.int32), categories
+
+
+def _sample_ages(rng, n):
+    bands = list(POPULATION_AGES)
+    codes, _ = _sample_categories(rng, n, {band: POPULATION_AGES[band] for band in bands})
+    lower = np.array([band[0] for band in bands])[codes]
+    return lower + rng.integers(0, 10, n)
+
+
+def _sample_dates(rng, n, expectations):
+    earliest = np.datetime64(expectations["date"]["earliest"], 'D')
+    latest = np.datetime64(expectations["date"]["latest"], 'D')
+    u = rng.random(n)
+    if expectations.get("rate") == "exponential_increase":
+        u = np.log1p(u * np.expm1(EXPONENTIAL_RATE)) / EXPONENTIAL_RATE
+    elif expectations.get("rate") == "exponential_decrease":
+        u = 1 - np.log1p(u * np.expm1(EXPONENTIAL_RATE)) / EXPONENTIAL_RATE
+    days = (u * (latest - earliest).astype(np.int64)).astype(np.int64)
+    return earliest + days.astype('timedelta64[D]')
+
+
+def sample_variable(rng, n, variable, default_expectations):
+    """
+    Samples `n` values of `variable`. Returns (values, missing mask or None), where
+    categorical values are returned as pd.Categorical.
+    """
+    if variable.name == 'population':
+        return np.ones(n, dtype=np.int8), None
+
+    expectations = {**default_expectations, **variable.expectations}
+    incidence = 1 if expectations.get("rate") == "universal" else expectations.get("incidence", 1)
+    missing = rng.random(n) >= incidence if incidence < 1 else None
+
+    if "category" in variable.expectations:
+        codes, categories = _sample_categories(rng, n, expectations["category"]["ratios"])
+        if missing is not None:
+            codes[missing] = -1
+        return pd.Categorical.from_codes(codes, categories=categories), None
+
+    if "int" in variable.expectations:
+        distribution = expectations["int"]
+        if distribution["distribution"] == "population_ages":
+            values = _sample_ages(rng, n)
+        else:
+            values = np.rint(rng.normal(distribution["mean"], distribution["stddev"], n)).astype(np.int64)
+        if missing is not None:
+            values[missing] = 0
+        return values, None
+
+    if variable.returning is not None and variable.returning.startswith('date'):
+        return _sample_dates(rng, n, expectations), missing
+
+    # binary flags, including the default returning of clinical event queries
+    flags = rng.random(n) < incidence
+    return flags.astype(np.int8), None
+
+
+def generate_batch(rng, patient_ids, variables, default_expectations):
+    columns = {}
+    for variable in variables:
+        values, missing = sample_variable(rng, len(patient_ids), variable, default_expectations)
+        if missing is not None:
+            values = pd.array(values)
+            values[missing] = None
+        columns[variable.name] = values
+    columns['patient_id'] = patient_ids
+    return pd.DataFrame(columns)
+
+
+def write_extract(path, population, variables, default_expectations, seed, chunksize):
+    """Writes an extract of `population` patients to `path` in batches of `chunksize`."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+
+    writer = None
+    for start in range(0, population, chunksize):
+        patient_ids = np.arange(start + 1, min(start + chunksize, population) + 1)
+        batch = generate_batch(rng, patient_ids, variables, default_expectations)
+
+        if pa is None:
+            batch.to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+            continue
+
+        table = pa.Table.from_pandas(batch, preserve_index=False)
+        table = table.replace_schema_metadata(None)
+        if writer is None:
+            writer = pa_csv.CSVWriter(path, table.schema)
+        writer.write_table(table)
+
+    if writer is not None:
+        writer.close()
+
+
+def _write_extract(task):
+    path, population, study_definition, seed, chunksize, columnar_cache = task
+    default_expectations, variables = load_study_variables(study_definition)
+    write_extract(path, population, variables, default_expectations, seed, chunksize)
+    if columnar_cache:
+        from columnar_cache import convert
+        convert(path)
+    return path
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.index_date_range:
+        paths = [os.path.join(args.output_dir, f'input_{date}.csv')
+                 for date in parse_index_date_range(args.index_date_range)]
+    else:
+        paths = [args.output]
+
+    # the same patients appear in every index date, with values re-sampled each time
+    tasks = [(path, args.population, args.study_definition, args.seed + i, args.chunksize, args.columnar_cache)
+             for i, path in enumerate(paths)]
+
+    if args.workers is None or args.workers <= 1 or len(tasks) <= 1:
+        list(map(_write_extract, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=min(args.workers, len(tasks))) as executor:
+            list(executor.map(_write_extract, tasks))
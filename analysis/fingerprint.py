@@ -0,0 +1,92 @@
+import os
+import ast
+import json
+import hashlib
+
+# local modules are imported from the analysis scripts and the notebook utilities
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE_DIRS = [os.path.join(ROOT, 'analysis'), os.path.join(ROOT, 'notebooks')]
+
+
+def file_digest(path, block_size=1 << 20):
+    """Returns the sha256 hex digest of the file at `path`, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path, content_hash=True, previous=None):
+    """
+    Returns dict of path, size and mtime for the file at `path`, plus its
+    content hash unless `content_hash` is False. The hash of a `previous`
+    fingerprint with the same path, size and mtime is reused rather than
+    reading the file again.
+    """
+    stat = os.stat(path)
+    fingerprint = {"path": os.path.normpath(path), "size": stat.st_size, "mtime": stat.st_mtime}
+    if content_hash:
+        if previous and previous.get("sha256") and all(previous.get(k) == v for k, v in fingerprint.items()):
+            fingerprint["sha256"] = previous["sha256"]
+        else:
+            fingerprint["sha256"] = file_digest(path)
+    return fingerprint
+
+
+def is_unchanged(path, fingerprint):
+    """
+    Checks the file at `path` against a previously recorded `fingerprint`.
+    Size and mtime are compared first and the content is only re-hashed when
+    the mtime has moved, so touched but identical files still count as unchanged.
+    """
+    if fingerprint is None or not os.path.exists(path):
+        return False
+
+    stat = os.stat(path)
+    if os.path.normpath(path) != fingerprint["path"] or stat.st_size != fingerprint["size"]:
+        return False
+    if stat.st_mtime == fingerprint["mtime"]:
+        return True
+    return file_digest(path) == fingerprint.get("sha256")
+
+
+def _module_file(name):
+    for directory in MODULE_DIRS:
+        path = os.path.join(directory, name.split('.')[0] + '.py')
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _imported_modules(source):
+    names = set()
+    for node in ast.walk(ast.parse(source)):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.add(node.module)
+    return names
+
+
+def _notebook_source(path):
+    with open(path) as f:
+        cells = json.load(f)["cells"]
+    lines = [line for cell in cells if cell["cell_type"] == 'code'
+             for line in ''.join(cell["source"]).splitlines() if not line.lstrip().startswith(('%', '!'))]
+    return '\n'.join(lines)
+
+
+def source_files(paths):
+    """The scripts or notebooks at `paths` and the local modules they import, transitively."""
+    files = set()
+    pending = [os.path.abspath(path) for path in paths]
+    while pending:
+        path = pending.pop()
+        if path in files:
+            continue
+        files.add(path)
+        with open(path) as f:
+            source = _notebook_source(path) if path.endswith('.ipynb') else f.read()
+        pending.extend(filter(None, map(_module_file, _imported_modules(source))))
+    return sorted(files)
@@ -0,0 +1,146 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from columnar_cache import iter_csv
+from get_patients_counts import get_input_files
+from study_parser import load_measures, STUDY_DEFINITION
+from usage_cube import UsageCube, cube_measures, CUBE_DIMENSIONS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Calculate every measure in the study definition in one pass over each monthly extract")
+    parser.add_argument('--input-dir', default='output/measures')
+    parser.add_argument('--output-dir', default='output/measures')
+    parser.add_argument('--study-definition', default=STUDY_DEFINITION)
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--usage-cube-dimensions', nargs='*', default=CUBE_DIMENSIONS,
+                        help="dimensions of the event code usage cube written to usage_cube.npz, none to skip it")
+    return parser.parse_args()
+
+
+def _factorize(values):
+    """Like pd.factorize, but keeps missing values as their own group."""
+    codes, uniques = pd.factorize(values)
+    missing = codes == -1
+    if missing.any():
+        codes[missing] = len(uniques)
+        uniques = list(uniques) + [np.nan]
+    return codes, list(uniques)
+
+
+def _group_sums(columns, numerator, denominator):
+    """
+    Sums `numerator` and `denominator` over the groups formed by `columns`, a
+    list of (name, codes, uniques). Codes are combined into a single mixed-radix
+    key so every group is summed by one bincount.
+    """
+    key = np.zeros(len(numerator), dtype=np.int64)
+    size = 1
+    for _, codes, uniques in columns:
+        key = key * len(uniques) + codes
+        size *= len(uniques)
+
+    rows = np.bincount(key, minlength=size)
+    num = np.bincount(key, weights=numerator, minlength=size)
+    den = np.bincount(key, weights=denominator, minlength=size)
+    present = np.flatnonzero(rows)
+
+    groups = {}
+    remainder = present
+    for name, _, uniques in reversed(columns):
+        groups[name] = np.asarray(uniques, dtype=object)[remainder % len(uniques)]
+        remainder = remainder // len(uniques)
+
+    return pd.DataFrame({**{name: groups[name] for name, _, _ in columns},
+                         'numerator': num[present], 'denominator': den[present]})
+
+
+def calculate_measures(chunks, measures):
+    """
+    Calculates every measure over an iterable of extract chunks in a single pass.
+    Returns {measure id: DataFrame of group_by columns, numerator and denominator}.
+    """
+    partials = {m.id: [] for m in measures}
+    group_columns = {c for m in measures for c in (m.group_by or [])}
+
+    for chunk in chunks:
+        factorized = {c: _factorize(chunk[c]) for c in group_columns}
+
+        for m in measures:
+            numerator = chunk[m.numerator].fillna(0).to_numpy(dtype=np.float64)
+            if m.denominator in chunk.columns:
+                denominator = chunk[m.denominator].fillna(0).to_numpy(dtype=np.float64)
+            else:
+                # every patient in the extract is in the study population
+                denominator = np.ones(len(chunk))
+
+            columns = [(c, *factorized[c]) for c in (m.group_by or [])]
+            partials[m.id].append(_group_sums(columns, numerator, denominator))
+
+    results = {}
+    for m in measures:
+        df = pd.concat(partials[m.id], ignore_index=True)
+        if m.group_by:
+            df = df.groupby(m.group_by, dropna=False, sort=True)[['numerator', 'denominator']].sum().reset_index()
+        else:
+            df = df[['numerator', 'denominator']].sum().to_frame().T
+        results[m.id] = df
+    return results
+
+
+def _process_file(task):
+    date, path, measures, chunksize = task
+    columns = {c for m in measures for c in [m.numerator, m.denominator] + (m.group_by or [])}
+    chunks = iter_csv(path, columns=columns, chunksize=chunksize)
+    return date, calculate_measures(chunks, measures)
+
+
+def generate_measures(files, measures, chunksize, workers):
+    """
+    Returns {measure id: measure DataFrame} across all the monthly extracts in
+    `files`, with columns named as in the measure definitions plus value and date.
+    """
+    tasks = [(date, path, measures, chunksize) for date, path in sorted(files.items())]
+
+    if workers is None or workers <= 1 or len(tasks) <= 1:
+        results = list(map(_process_file, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+            results = list(executor.map(_process_file, tasks))
+
+    output = {}
+    for m in measures:
+        frames = []
+        for date, by_measure in results:
+            df = by_measure[m.id]
+            df = df.rename(columns={'numerator': m.numerator, 'denominator': m.denominator})
+            df[[m.numerator, m.denominator]] = df[[m.numerator, m.denominator]].astype(np.int64)
+            df['value'] = df[m.numerator] / df[m.denominator]
+            df['date'] = date
+            frames.append(df)
+        output[m.id] = pd.concat(frames, ignore_index=True)
+    return output
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    measures = load_measures(args.study_definition)
+    files = get_input_files(args.input_dir)
+
+    # the usage cube is calculated in the same pass, as extra measures
+    cube = cube_measures(args.usage_cube_dimensions) if args.usage_cube_dimensions else []
+    output = generate_measures(files, measures + cube, args.chunksize, args.workers)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    for m in measures:
+        output[m.id].to_csv(os.path.join(args.output_dir, f'measure_{m.id}.csv'), index=False)
+
+    if cube:
+        UsageCube.from_measure_output(output, args.usage_cube_dimensions).save(
+            os.path.join(args.output_dir, 'usage_cube.npz'))
@@ -1,143 +1,90 @@
-import pandas as pd
-import matplotlib.pyplot as plt
 import os
-import numpy as np
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
 
+from measure_loader import load_measure_frames
+from perf import stage, enable, report_path
+from study_parser import load_measures
 
-if not os.path.exists('output/figures'):
-    os.mkdir('output/figures')
 
+PLOTTED_MEASURES = ["had_pulse_ox_total", "had_pulse_ox_by_sex", "had_pulse_ox_by_region", "had_pulse_ox_by_age_band"]
 
-class Measure:
-  def __init__(self, id, numerator, denominator, group_by):
-    self.id = id
-    self.numerator = numerator
-    self.denominator = denominator
-    self.group_by = group_by
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Plot the measures")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="number of figures rendered concurrently")
+    parser.add_argument('--perf-report', nargs='?', const=report_path('generate_plots'), default=None,
+                        help="record the time and peak memory of each stage in this JSON report")
+    return parser.parse_args()
 
-measures = [
-    Measure(
-        id="pulse_ox_by_sex",
-        numerator="had_pulse_ox",
-        denominator="population",
-        group_by=["sex"],
-    ),
 
-    Measure(
-        id="pulse_ox_by_region",
-        numerator="had_pulse_ox",
-        denominator="population",
-        group_by=["region"],
-    ),
-
-    Measure(
-        id="pulse_ox_by_age_band",
-        numerator="had_pulse_ox",
-        denominator="population",
-        group_by=["age_band"],
-    ),
-
-    Measure(
-        id="pulse_ox_total",
-        numerator="had_pulse_ox",
-        denominator="population",
-        group_by=None,
-    ),
-]
-
-
-
-measures_df_sex = pd.read_csv('output/measures/measure_had_pulse_ox_by_sex.csv')
-measures_df_region = pd.read_csv(
-    'output/measures/measure_had_pulse_ox_by_region.csv')
-measures_df_age = pd.read_csv(
-    'output/measures/measure_had_pulse_ox_by_age_band.csv')
-measures_df_total = pd.read_csv(
-    'output/measures/measure_had_pulse_ox_total.csv')
-
-
-#temporary fix for population not working in Measures
-measures_df_total = measures_df_total.groupby(
-    ['date'])['had_pulse_ox', 'population'].sum().reset_index()
-measures_df_total['value'] = measures_df_total['had_pulse_ox'] / \
-    measures_df_total['population']
-
-
-def to_datetime_sort(df):
-    df['date'] = pd.to_datetime(df['date'])
-    df.sort_values(by='date')
-
-
-to_datetime_sort(measures_df_sex)
-to_datetime_sort(measures_df_region)
-to_datetime_sort(measures_df_age)
-to_datetime_sort(measures_df_total)
-
-
-def redact_small_numbers(df, n, m):
+def plot_measures(df, title, filename, column_to_plot, category=False, y_label='Number per 100, 000'):
     """
-    Takes measures df and converts any row to nana where value of denominator or numerater in measure m equal to 
-    or below n
-    Returns df of same shape.
+    Renders one figure to output/figures/{filename}.jpeg. The figure is built as its
+    own Figure object on the Agg canvas rather than on the global pyplot state, so
+    several can be rendered at once in separate processes.
     """
-    mask_n = df[m.numerator].isin(list(range(0, n+1)))
-    mask_d = df[m.denominator].isin(list(range(0, n+1)))
-    mask = mask_n | mask_d
-    df.loc[mask, [m.numerator, m.denominator, 'value']] = np.nan
-    return df
-
-
-redact_small_numbers(measures_df_sex, 5, measures[0])
-redact_small_numbers(measures_df_region, 5, measures[1])
-redact_small_numbers(measures_df_age, 5, measures[2])
-redact_small_numbers(measures_df_total, 5, measures[3])
-
-def calculate_rate(df, value_col='had_pulse_ox', population_col='population'):
-    num_per_hundred_thousand = df[value_col]/(df[population_col]/1000)
-    df['num_per_hundred_thousand'] = num_per_hundred_thousand
+    fig = Figure()
+    ax = fig.add_subplot()
 
+    if category:
+        for unique_category, df_subset in df.groupby(category, sort=False, dropna=False, observed=True):
+            ax.plot(df_subset['date'], df_subset[column_to_plot], label=unique_category)
+    else:
+        ax.plot(df['date'], df[column_to_plot])
 
-calculate_rate(measures_df_sex)
-calculate_rate(measures_df_age)
-calculate_rate(measures_df_region)
-calculate_rate(measures_df_total)
+    ax.set_ylabel(y_label)
+    ax.set_xlabel('Date')
+    ax.tick_params(axis='x', labelrotation=90)
+    ax.set_title(title)
 
+    if category:
+        ax.legend(bbox_to_anchor=(1.04, 1), loc="upper left")
 
-def plot_measures(df, title, filename, column_to_plot, category=False, y_label='Number per 100, 000'):
+    fig.savefig(f'output/figures/{filename}.jpeg', bbox_inches='tight')
 
-    if category:
-        for unique_category in df[category].unique():
 
-            df_subset = df[df[category] == unique_category]
+def _render(job):
+    args, kwargs = job
+    plot_measures(*args, **kwargs)
 
-            plt.plot(df_subset['date'], df_subset[column_to_plot])
-    else:
-        plt.plot(df['date'], df[column_to_plot])
 
-    plt.ylabel(y_label)
-    plt.xlabel('Date')
-    plt.xticks(rotation='vertical')
-    plt.title(title)
+def render_figures(jobs, workers):
+    """Renders each (args, kwargs) job for plot_measures, in a process pool if workers > 1."""
+    if workers is None or workers <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            _render(job)
+        return
 
-    if category:
-        plt.legend(df[category].unique(), bbox_to_anchor=(
-            1.04, 1), loc="upper left")
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as executor:
+        list(executor.map(_render, jobs))
 
-    else:
-        pass
 
-    plt.savefig(f'output/figures/{filename}.jpeg', bbox_inches='tight')
-   
-    plt.clf()
+if __name__ == "__main__":
+    args = parse_args()
+    if args.perf_report:
+        enable(args.perf_report)
 
+    if not os.path.exists('output/figures'):
+        os.mkdir('output/figures')
 
-plot_measures(measures_df_total, 'Pulse Oximetry use across Whole Population',
-              'population_rates', 'had_pulse_ox', category=False, y_label='Total Number')
+    frames = load_measure_frames([m for m in load_measures() if m.id in PLOTTED_MEASURES],
+                                 rate_column='num_per_hundred_thousand')
+    measures_df_total = frames['had_pulse_ox_total']
+    measures_df_sex = frames['had_pulse_ox_by_sex']
+    measures_df_region = frames['had_pulse_ox_by_region']
+    measures_df_age = frames['had_pulse_ox_by_age_band']
 
-plot_measures(measures_df_sex,
-              'Pulse Oximetry use by Sex per 1000', 'sex_rates', 'num_per_hundred_thousand', category='sex', )
-plot_measures(measures_df_region,
-              'Pulse Oximetry use by Region per 1000', 'region_rates', 'num_per_hundred_thousand', category='region')
-plot_measures(measures_df_age,
-              'Pulse Oximetry use by Age Band per 1000',  'age_rates', 'num_per_hundred_thousand', category='age_band')
+    with stage("plotting"):
+        render_figures([
+            ((measures_df_total, 'Pulse Oximetry use across Whole Population',
+              'population_rates', 'had_pulse_ox'), dict(category=False, y_label='Total Number')),
+            ((measures_df_sex, 'Pulse Oximetry use by Sex per 1000',
+              'sex_rates', 'num_per_hundred_thousand'), dict(category='sex')),
+            ((measures_df_region, 'Pulse Oximetry use by Region per 1000',
+              'region_rates', 'num_per_hundred_thousand'), dict(category='region')),
+            ((measures_df_age, 'Pulse Oximetry use by Age Band per 1000',
+              'age_rates', 'num_per_hundred_thousand'), dict(category='age_band')),
+        ], args.workers)
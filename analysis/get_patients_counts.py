@@ -1,22 +1,135 @@
-import pandas as pd
 import os
-import json
+import argparse
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
+from columnar_cache import iter_csv
+from fingerprint import file_fingerprint, is_unchanged
+from patient_store import write_month, remove_months, month_path, read_manifest, write_manifest
+from patient_windows import PatientWindows
+from patient_months import PatientMonths
+from perf import stage, enable, report_path
 
-patients_total = {}
-for file in os.listdir('output'):
 
-        if file.startswith('input_2'):
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Get the ids of patients with an event in each monthly extract")
+    parser.add_argument('--input-dir', default='output/measures')
+    parser.add_argument('--output-dir', default='output/patient_count')
+    parser.add_argument('--event-column', default='had_pulse_ox')
+    parser.add_argument('--chunksize', type=int, default=1_000_000,
+                        help="rows read from an extract at a time")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="number of extracts processed concurrently")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only process extracts that are new or changed since the last run")
+    parser.add_argument('--perf-report', nargs='?', const=report_path('get_patient_count'), default=None,
+                        help="record the time and peak memory of each stage in this JSON report")
+    return parser.parse_args()
+
+
+def get_input_files(input_dir):
+    """Returns {date: path} for every monthly `input_YYYY-MM-DD.csv` extract."""
+    files = {}
+    for file in os.listdir(input_dir):
+        if file.startswith('input_2') and file.endswith('.csv'):
             date = file.split('_')[-1][:-4]
+            files[date] = os.path.join(input_dir, file)
+    return files
+
+
+def get_event_patients(path, event_column, chunksize):
+    """
+    Streams the extract at `path` in chunks, reading only `patient_id` and `event_column`
+    from its columnar cache if fresh, or the CSV otherwise.
+    Returns sorted array of unique ids of patients where the event column is 1.
+    """
+    patients = []
+    for chunk in iter_csv(path, columns=['patient_id', event_column], chunksize=chunksize):
+        has_event = (chunk[event_column] == 1).fillna(False).to_numpy(dtype=bool)
+        patients.append(chunk['patient_id'].to_numpy()[has_event])
+
+    if not patients:
+        return np.array([], dtype=np.int64)
+    return np.unique(np.concatenate(patients))
+
+
+def _process_file(task):
+    date, path, event_column, chunksize, previous = task
+    # the extract is only hashed again if its size or mtime moved since `previous`
+    return date, (get_event_patients(path, event_column, chunksize), file_fingerprint(path, previous=previous))
+
+
+def get_patients_by_month(files, event_column, chunksize, workers, fingerprints=None):
+    """
+    Maps over the monthly extracts in a process pool and reduces the results into
+    a single {date: (patient ids, extract fingerprint)} dict. `fingerprints` are
+    the {date: fingerprint} of a previous run, whose hashes are reused for
+    extracts with the same size and mtime.
+    """
+    fingerprints = fingerprints or {}
+    tasks = [(date, path, event_column, chunksize, fingerprints.get(date)) for date, path in sorted(files.items())]
+
+    if workers is None or workers <= 1 or len(tasks) <= 1:
+        results = map(_process_file, tasks)
+        return dict(results)
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+        results = executor.map(_process_file, tasks)
+        return dict(results)
+
+
+def get_changed_files(files, manifest, event_column, output_dir):
+    """
+    Returns the subset of `files` that has to be processed, given the `manifest`
+    of the previous run. Everything is processed if the event column changed.
+    """
+    if manifest["event_column"] != event_column:
+        return files
+
+    changed = {}
+    for date, path in files.items():
+        fingerprint = manifest["months"].get(date)
+        if not os.path.exists(month_path(output_dir, date)) or not is_unchanged(path, fingerprint):
+            changed[date] = path
+    return changed
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.perf_report:
+        enable(args.perf_report)
+
+    files = get_input_files(args.input_dir)
+    previous = read_manifest(args.output_dir)
+    manifest = {"event_column": args.event_column, "months": {}}
+
+    if args.incremental:
+        if previous["event_column"] == args.event_column:
+            manifest["months"] = {date: f for date, f in previous["months"].items() if date in files}
+        changed = get_changed_files(files, previous, args.event_column, args.output_dir)
+    else:
+        changed = files
+
+    # the store only holds the months of the current extracts
+    remove_months(args.output_dir, keep=files)
 
-            df = pd.read_csv(os.path.join('output', file))
-            
-            patients = np.unique(df['patient_id'][df['event_x']==1])
+    # extracts are read in worker processes, so their memory is not in the peak
+    with stage("read_extracts"):
+        patients_by_month = get_patients_by_month(
+            changed, args.event_column, args.chunksize, args.workers, previous["months"])
 
-            patients_total[date] =[int(x) for x in patients]
+    with stage("write_store", rows=sum(len(p) for p, _ in patients_by_month.values())):
+        for date, (patients, fingerprint) in patients_by_month.items():
+            write_month(args.output_dir, date, patients)
+            manifest["months"][date] = fingerprint
 
+        write_manifest(args.output_dir, manifest)
 
+    with stage("windows"):
+        PatientWindows.from_store(args.output_dir).save(
+            os.path.join(args.output_dir, 'windows.npz'))
 
-with open('output/patient_count.json', 'w') as f:
-    json.dump({"num_patients": patients_total}, f)
\ No newline at end of file
+    with stage("months"):
+        PatientMonths.from_store(args.output_dir).save(
+            os.path.join(args.output_dir, 'months.npz'))
@@ -0,0 +1,106 @@
+import os
+import threading
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from columnar_cache import load_csv
+from disclosure import redact_small_numbers
+from fingerprint import file_fingerprint
+from rates import calculate_rate
+
+# Loads measure files ready for plotting: dates parsed and sorted, small numbers
+# redacted and rates calculated as part of the load. Files are read in a thread
+# pool (the CSV and feather readers release the GIL) and the prepared frames are
+# kept in a size-bounded LRU cache keyed by file fingerprint, so a second load of
+# an unchanged file in the same process costs a copy instead of a read.
+
+MEASURES_DIR = 'output/measures'
+CACHE_BYTES = 512 * 2 ** 20
+
+
+class FrameCache:
+    """LRU cache of DataFrames holding at most `max_bytes` of frame memory."""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.frames = OrderedDict()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.frames:
+                return None
+            self.frames.move_to_end(key)
+            return self.frames[key][0]
+
+    def put(self, key, df):
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.frames:
+                self.nbytes -= self.frames.pop(key)[1]
+            self.frames[key] = (df, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self.frames.popitem(last=False)
+                self.nbytes -= evicted
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.nbytes = 0
+
+
+_cache = FrameCache()
+
+
+def measure_path(measure, measures_dir=MEASURES_DIR):
+    return os.path.join(measures_dir, f'measure_{measure.id}.csv')
+
+
+def _prepare(df, measure, redact, rate_per, rate_column):
+    df['date'] = pd.to_datetime(df['date'])
+    df.sort_values(by='date', kind='stable', inplace=True)
+    df.reset_index(drop=True, inplace=True)
+    if redact is not None:
+        redact_small_numbers(df, redact, measure)
+    return calculate_rate(df, measure.numerator, measure.denominator, rate_per, rate_column)
+
+
+def load_measure_frame(measure, measures_dir=MEASURES_DIR, redact=5, rate_per=1000, rate_column='rate'):
+    """
+    Returns the frame of `measure` sorted by date, with numbers at or below `redact`
+    suppressed (None to skip) and `rate_column` per `rate_per` of the denominator.
+    The frame is a copy, so callers can modify it without touching the cache.
+    """
+    path = measure_path(measure, measures_dir)
+    fingerprint = file_fingerprint(path, content_hash=False)
+    key = (fingerprint["path"], fingerprint["size"], fingerprint["mtime"],
+           measure.numerator, measure.denominator, tuple(measure.group_by or ()), redact, rate_per, rate_column)
+
+    df = _cache.get(key)
+    if df is None:
+        df = _prepare(load_csv(path), measure, redact, rate_per, rate_column)
+        _cache.put(key, df)
+    return df.copy()
+
+
+def load_measure_frames(measures, measures_dir=MEASURES_DIR, redact=5, rate_per=1000, rate_column='rate',
+                        workers=None):
+    """Loads every measure in `measures` concurrently. Returns {measure id: frame}."""
+    def load(measure):
+        return load_measure_frame(measure, measures_dir, redact, rate_per, rate_column)
+
+    workers = workers or min(8, len(measures)) or 1
+    if workers <= 1:
+        return {m.id: load(m) for m in measures}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip([m.id for m in measures], executor.map(load, measures)))
+
+
+def clear_cache():
+    _cache.clear()
@@ -0,0 +1,97 @@
+import os
+import numpy as np
+import pandas as pd
+
+from patient_store import list_months, load_month, union_patients
+
+_BYTE_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _mask_dtype(num_months):
+    for dtype in (np.uint16, np.uint32, np.uint64):
+        if num_months <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError(f"{num_months} months do not fit in a 64 bit mask")
+
+
+def _popcount(masks):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(masks).astype(np.int64)
+    # sum the set bits of each byte of the masks
+    byte_counts = _BYTE_POPCOUNT[masks.view(np.uint8)].reshape(len(masks), masks.itemsize)
+    return byte_counts.sum(axis=1, dtype=np.int64)
+
+
+class PatientMonths:
+    """
+    Longitudinal index of the patient store: the sorted ids of every patient with
+    an event in any month, and for each a bitmask of those months (bit i for
+    `dates[i]`, uint16 for up to 16 months, uint32 up to 32). Questions across
+    index dates are bit operations on the mask array instead of re-joining the
+    monthly files.
+    """
+
+    def __init__(self, dates, patients, masks):
+        self.dates = list(dates)
+        self.patients = patients
+        self.masks = masks
+
+    @classmethod
+    def from_store(cls, store_dir):
+        dates = list_months(store_dir)
+        patients = union_patients([load_month(store_dir, date) for date in dates])
+
+        dtype = _mask_dtype(len(dates))
+        masks = np.zeros(len(patients), dtype=dtype)
+        for i, date in enumerate(dates):
+            masks[np.searchsorted(patients, load_month(store_dir, date))] |= dtype(1 << i)
+
+        return cls(dates, patients, masks)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['dates'].tolist(), data['patients'], data['masks'])
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, dates=np.array(self.dates), patients=self.patients, masks=self.masks)
+
+    def _window_mask(self, start=None, end=None):
+        # dates are ISO strings so they can be compared directly
+        s = 0 if start is None else int(np.searchsorted(self.dates, start, side='left'))
+        e = len(self.dates) if end is None else int(np.searchsorted(self.dates, end, side='right'))
+        bits = sum(1 << i for i in range(s, e))
+        return self.masks.dtype.type(bits)
+
+    def months_per_patient(self, start=None, end=None):
+        """Number of months with an event per patient, from `start` to `end` inclusive."""
+        return _popcount(self.masks & self._window_mask(start, end))
+
+    def first_month(self):
+        """Index into `dates` of each patient's first month with an event, -1 for none."""
+        lowest = self.masks & (~self.masks + self.masks.dtype.type(1))
+        first = np.full(len(self.masks), -1, dtype=np.int64)
+        seen = lowest != 0
+        first[seen] = np.log2(lowest[seen].astype(np.float64)).astype(np.int64)
+        return first
+
+    def count(self, start=None, end=None):
+        """Number of distinct patients with an event in any month from `start` to `end` inclusive."""
+        return int(np.count_nonzero(self.masks & self._window_mask(start, end)))
+
+    def monitored_in_at_least(self, k, start=None, end=None):
+        """Number of patients with an event in at least `k` months from `start` to `end` inclusive."""
+        return int(np.count_nonzero(self.months_per_patient(start, end) >= k))
+
+    def new_and_returning(self):
+        """
+        Per month, the patients with an event for the first time (`new`) and those
+        seen in an earlier month too (`returning`).
+        """
+        first = self.first_month()
+        in_month = np.bincount(first[first >= 0], minlength=len(self.dates))
+        totals = np.array([np.count_nonzero(self.masks & self.masks.dtype.type(1 << i))
+                           for i in range(len(self.dates))], dtype=np.int64)
+        return pd.DataFrame({"new": in_month, "returning": totals - in_month},
+                            index=pd.Index(self.dates, name='date'))
@@ -0,0 +1,83 @@
+import os
+import json
+import numpy as np
+
+# One file per index date, each holding the sorted unique ids of the patients
+# with an event in that month as a uint64 .npy array. Arrays are opened with
+# memory mapping so counting never loads more than the months being unioned.
+
+def month_path(store_dir, date):
+    return os.path.join(store_dir, f'patients_{date}.npy')
+
+
+def write_month(store_dir, date, patients):
+    """Saves `patients` for `date` as a sorted, de-duplicated uint64 array."""
+    os.makedirs(store_dir, exist_ok=True)
+    patients = np.unique(np.asarray(patients, dtype=np.uint64))
+    np.save(month_path(store_dir, date), patients)
+
+
+def list_months(store_dir):
+    """Returns the sorted dates held in the store."""
+    dates = []
+    if not os.path.isdir(store_dir):
+        return dates
+    for file in os.listdir(store_dir):
+        if file.startswith('patients_') and file.endswith('.npy'):
+            dates.append(file[len('patients_'):-len('.npy')])
+    return sorted(dates)
+
+
+def remove_months(store_dir, keep):
+    """Deletes the months of the store whose date is not in `keep`. Returns the dates removed."""
+    removed = [date for date in list_months(store_dir) if date not in keep]
+    for date in removed:
+        os.remove(month_path(store_dir, date))
+    return removed
+
+
+def load_month(store_dir, date):
+    return np.load(month_path(store_dir, date), mmap_mode='r')
+
+
+def union_patients(arrays):
+    """
+    Returns the sorted union of sorted patient id arrays. The stable sort merges
+    the already sorted runs rather than re-sorting from scratch.
+    """
+    arrays = [a for a in arrays if len(a)]
+    if not arrays:
+        return np.array([], dtype=np.uint64)
+    patients = np.concatenate(arrays)
+    patients.sort(kind='stable')
+    keep = np.empty(len(patients), dtype=bool)
+    keep[0] = True
+    np.not_equal(patients[1:], patients[:-1], out=keep[1:])
+    return patients[keep]
+
+
+def count_distinct(store_dir, dates):
+    """Returns the number of distinct patients across the months in `dates`."""
+    return len(union_patients([load_month(store_dir, date) for date in dates]))
+
+
+def manifest_path(store_dir):
+    return os.path.join(store_dir, 'manifest.json')
+
+
+def read_manifest(store_dir):
+    """
+    Returns the manifest of processed extracts, {"event_column": ..., "months":
+    {date: fingerprint}}, or an empty manifest if the store has none yet.
+    """
+    path = manifest_path(store_dir)
+    if not os.path.exists(path):
+        return {"event_column": None, "months": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(store_dir, manifest):
+    os.makedirs(store_dir, exist_ok=True)
+    with open(manifest_path(store_dir), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
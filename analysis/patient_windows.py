@@ -0,0 +1,146 @@
+import os
+import numpy as np
+
+from patient_store import list_months, load_month, union_patients
+
+
+def _splitmix64(x):
+    """Vectorised splitmix64 finaliser, used to hash patient ids for the sketches."""
+    x = np.asarray(x, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        x = x + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def _bit_length(x):
+    """Vectorised int.bit_length for uint64 arrays."""
+    x = x.copy()
+    n = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = x >> np.uint64(shift)
+        mask = high != 0
+        n[mask] += shift
+        x[mask] = high[mask]
+    return n + (x != 0)
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch of a set of patient ids. With 2**precision registers the
+    relative standard error of the estimate is 1.04 / sqrt(2**precision), about
+    0.8% at the default precision of 14 (16KB per sketch).
+    """
+
+    def __init__(self, precision=14, registers=None):
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            registers = np.zeros(self.m, dtype=np.uint8)
+        self.registers = registers
+
+    @property
+    def error(self):
+        return 1.04 / np.sqrt(self.m)
+
+    def add(self, patients):
+        if not len(patients):
+            return self
+        hashes = _splitmix64(patients)
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        remainder = hashes & np.uint64((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - _bit_length(remainder) + 1
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+        return self
+
+    def union(self, *others):
+        registers = self.registers.copy()
+        for other in others:
+            np.maximum(registers, other.registers, out=registers)
+        return HyperLogLog(self.precision, registers)
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        estimate = alpha * self.m ** 2 / np.sum(np.exp2(-self.registers.astype(np.float64)))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * self.m and zeros:
+            # small range correction (linear counting)
+            estimate = self.m * np.log(self.m / zeros)
+        return int(round(estimate))
+
+
+class PatientWindows:
+    """
+    Distinct patient counts for any window of months in the patient store.
+
+    Exact counts come from `new_counts`, where `new_counts[i, j]` is the number of
+    patients with an event in month i whose previous event was in month j - 1
+    (column 0 for patients not seen before). A patient is counted once in the
+    window [s, e] at their first month inside it, i.e. where the previous event
+    was before s, so a query only sums `new_counts[s:e + 1, :s + 1]`.
+
+    Approximate counts union the per-month HyperLogLog sketches instead.
+    """
+
+    def __init__(self, dates, new_counts, sketches=None, precision=14):
+        self.dates = list(dates)
+        self.new_counts = np.asarray(new_counts, dtype=np.int64)
+        self.sketches = sketches
+        self.precision = precision
+
+    @classmethod
+    def from_store(cls, store_dir, precision=14):
+        dates = list_months(store_dir)
+        patients_all = union_patients([load_month(store_dir, date) for date in dates])
+
+        last_seen = np.full(len(patients_all), -1, dtype=np.int64)
+        new_counts = np.zeros((len(dates), len(dates) + 1), dtype=np.int64)
+        sketches = np.zeros((len(dates), 1 << precision), dtype=np.uint8)
+
+        for i, date in enumerate(dates):
+            patients = load_month(store_dir, date)
+            index = np.searchsorted(patients_all, patients)
+            new_counts[i] = np.bincount(last_seen[index] + 1, minlength=len(dates) + 1)
+            last_seen[index] = i
+            HyperLogLog(precision, sketches[i]).add(patients)
+
+        return cls(dates, new_counts, sketches, precision)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['dates'].tolist(), data['new_counts'], data['sketches'],
+                   int(data['precision']))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(path, dates=np.array(self.dates), new_counts=self.new_counts,
+                 sketches=self.sketches, precision=self.precision)
+
+    def _month_range(self, start, end):
+        # dates are ISO strings so they can be compared directly
+        s = 0 if start is None else int(np.searchsorted(self.dates, start, side='left'))
+        e = len(self.dates) if end is None else int(np.searchsorted(self.dates, end, side='right'))
+        return s, e
+
+    def count(self, start=None, end=None, approximate=False):
+        """
+        Returns the number of distinct patients with an event in any month from
+        `start` to `end` inclusive (ISO dates, either may be None for unbounded).
+        With `approximate`, the count is a HyperLogLog estimate with relative
+        standard error `self.error`.
+        """
+        s, e = self._month_range(start, end)
+        if s >= e:
+            return 0
+
+        if approximate:
+            registers = np.maximum.reduce(self.sketches[s:e], axis=0)
+            return HyperLogLog(self.precision, registers).estimate()
+
+        return int(self.new_counts[s:e, :s + 1].sum())
+
+    @property
+    def error(self):
+        return HyperLogLog(self.precision).error
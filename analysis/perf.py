@@ -0,0 +1,126 @@
+import os
+import sys
+import json
+import time
+import resource
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+# Per-stage timing and peak memory for the analysis actions. Stages are marked
+# with `with stage("load", rows=len(df)):` or the `@timed("percentiles")`
+# decorator, and are only measured once enable() has been called (or the
+# PERF_REPORT environment variable names a report path), so they cost a single
+# flag check otherwise. The report is rewritten as each stage finishes, so a
+# notebook kernel that is never shut down cleanly still leaves it behind.
+#
+# Each thread keeps its own stack of open stages, so stages run in worker
+# threads (e.g. the measure loader's pool) are recorded as top-level stages of
+# that thread. Traced memory is process wide, so their peaks overlap.
+
+_state = {"path": os.environ.get("PERF_REPORT") or None, "stages": []}
+_local = threading.local()
+_lock = threading.Lock()
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def enabled():
+    return _state["path"] is not None
+
+
+def enable(path):
+    """Starts recording stages, writing the report to `path`."""
+    _state["path"] = path
+
+
+def report_path(action, output_dir='output'):
+    """Each action writes its own report, as actions cannot share an output file."""
+    return os.path.join(output_dir, f'perf_report_{action}.json')
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    unit = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20
+
+
+def write_report(path=None):
+    path = path or _state["path"]
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({"script": os.path.basename(sys.argv[0]), "peak_rss_mb": _peak_rss_mb(),
+                   "stages": _state["stages"]}, f, indent=2)
+
+
+@contextmanager
+def stage(name, rows=None):
+    """
+    Records the elapsed time, peak traced memory and row count of the enclosed block.
+    Yields the stage record, so `rows` can also be set once it is known.
+    """
+    if not enabled():
+        yield {}
+        return
+
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    # a nested stage resets the peak, so the enclosing stage keeps the peak so far
+    stack = _stack()
+    if stack:
+        stack[-1]["_peak"] = max(stack[-1]["_peak"], tracemalloc.get_traced_memory()[1])
+    tracemalloc.reset_peak()
+
+    record = {"stage": name, "rows": rows, "_peak": 0}
+    stack.append(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["elapsed_s"] = time.perf_counter() - start
+        stack.pop()
+
+        peak = max(record.pop("_peak"), tracemalloc.get_traced_memory()[1])
+        record["peak_memory_mb"] = peak / 2 ** 20
+        if stack:
+            stack[-1]["_peak"] = max(stack[-1]["_peak"], peak)
+        record["parent"] = stack[-1]["stage"] if stack else None
+        if record["rows"] is not None:
+            record["rows"] = int(record["rows"])
+        with _lock:
+            _state["stages"].append(record)
+            write_report()
+
+
+def _rows(value):
+    """Rows of a frame or list of frames, otherwise None."""
+    if hasattr(value, 'shape'):
+        return value.shape[0]
+    if isinstance(value, (list, tuple)) and value and all(hasattr(v, 'shape') for v in value):
+        return sum(v.shape[0] for v in value)
+    return None
+
+
+def timed(name):
+    """
+    Decorates a function so each call is recorded as a stage. Rows are those of the
+    frame(s) passed as the first argument, or of the returned frame.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled():
+                return function(*args, **kwargs)
+            with stage(name, _rows(args[0]) if args else None) as record:
+                result = function(*args, **kwargs)
+                if record["rows"] is None:
+                    record["rows"] = _rows(result)
+                return result
+        return wrapper
+    return decorator
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+from perf import timed
+
+# Rates, their confidence intervals and funnel plot control limits, computed for
+# every row of a measure frame at once with NumPy (no per-group loops, no scipy).
+
+# two-sided z for the usual funnel plot limits
+Z_95 = 1.959964
+Z_998 = 3.090232
+FUNNEL_LIMITS = {"95": Z_95, "998": Z_998}
+
+
+def _values(series):
+    return pd.Series(series).to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+def wilson_interval(events, population, z=Z_95):
+    """Wilson score interval of the proportion events / population. Returns (lower, upper)."""
+    events, population = _values(events), _values(population)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = events / population
+        denominator = 1 + z ** 2 / population
+        centre = (p + z ** 2 / (2 * population)) / denominator
+        half_width = z * np.sqrt(p * (1 - p) / population + z ** 2 / (4 * population ** 2)) / denominator
+    return np.clip(centre - half_width, 0, 1), np.clip(centre + half_width, 0, 1)
+
+
+def poisson_interval(events, z=Z_95):
+    """Byar's approximation to the exact Poisson interval of a count. Returns (lower, upper)."""
+    events = _values(events)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lower = events * (1 - 1 / (9 * events) - z / (3 * np.sqrt(events))) ** 3
+        upper = (events + 1) * (1 - 1 / (9 * (events + 1)) + z / (3 * np.sqrt(events + 1))) ** 3
+    return np.where(events == 0, 0, lower), upper
+
+
+@timed("rates")
+def calculate_rate(df, value_col='had_pulse_ox', population_col='population', rate_per=1000, column='rate',
+                   ci=None, z=Z_95):
+    """
+    Adds `column`, the number of `value_col` events per `rate_per` of `population_col`, in place.
+    With `ci` of "wilson" or "poisson" the interval is added as `{column}_lower` and `{column}_upper`.
+    """
+    df[column] = df[value_col] / (df[population_col] / rate_per)
+
+    if ci == "wilson":
+        lower, upper = wilson_interval(df[value_col], df[population_col], z)
+    elif ci == "poisson":
+        lower, upper = poisson_interval(df[value_col], z)
+        population = _values(df[population_col])
+        lower, upper = lower / population, upper / population
+    elif ci is not None:
+        raise ValueError(f"unknown confidence interval {ci!r}, expected 'wilson' or 'poisson'")
+    else:
+        return df
+
+    df[f'{column}_lower'] = lower * rate_per
+    df[f'{column}_upper'] = upper * rate_per
+    return df
+
+
+@timed("funnel_limits")
+def funnel_limits(df, value_col='had_pulse_ox', population_col='population', period_column='date',
+                  rate_per=1000, limits=FUNNEL_LIMITS):
+    """
+    Funnel plot control limits for every row, against the pooled proportion of its period.
+    Adds, in place:
+      `target`, the pooled rate of the period per `rate_per`
+      `lower_{name}` / `upper_{name}` for each {name: z} of `limits`, per `rate_per`
+      `outlier`, 1 above the widest upper limit, -1 below the widest lower limit and 0 otherwise
+    Rows with missing (e.g. redacted) events are left out of the pooled proportion and flagged 0.
+    """
+    events, population = _values(df[value_col]), _values(df[population_col])
+    codes, periods = pd.factorize(df[period_column])
+    keep = (codes >= 0) & ~np.isnan(events) & ~np.isnan(population)
+
+    # one extra slot so rows without a period (code -1) index a missing target
+    pooled_events = np.bincount(codes[keep], weights=events[keep], minlength=len(periods) + 1)
+    pooled_population = np.bincount(codes[keep], weights=population[keep], minlength=len(periods) + 1)
+    pooled_population[-1] = np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        target = (pooled_events / pooled_population)[codes]
+        standard_error = np.sqrt(target * (1 - target) / population)
+        observed = events / population
+
+    df['target'] = target * rate_per
+    for name, z in limits.items():
+        df[f'lower_{name}'] = np.clip(target - z * standard_error, 0, 1) * rate_per
+        df[f'upper_{name}'] = np.clip(target + z * standard_error, 0, 1) * rate_per
+
+    z = max(limits.values())
+    lower = np.clip(target - z * standard_error, 0, 1)
+    upper = np.clip(target + z * standard_error, 0, 1)
+    outlier = np.zeros(len(df), dtype=np.int8)
+    with np.errstate(invalid='ignore'):
+        outlier[observed > upper] = 1
+        outlier[observed < lower] = -1
+    df['outlier'] = outlier
+    return df
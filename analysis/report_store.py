@@ -0,0 +1,85 @@
+import os
+import json
+import hashlib
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+from fingerprint import file_digest
+
+# Precomputed notebook artifacts under output/report: one file per table or
+# figure frame (feather, keeping index and dtypes, or a pickle without pyarrow)
+# and a manifest.json holding the scalar values and the hash of the inputs
+# they were computed from.
+
+REPORT_DIR = 'output/report'
+
+
+def input_key(paths):
+    """Hash of the contents of `paths`, in order, so any changed input gives a new key."""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.normpath(path).encode())
+        digest.update(file_digest(path).encode())
+    return digest.hexdigest()
+
+
+def manifest_path(report_dir):
+    return os.path.join(report_dir, 'manifest.json')
+
+
+def read_manifest(report_dir):
+    path = manifest_path(report_dir)
+    if not os.path.exists(path):
+        return {"key": None, "frames": {}, "values": {}}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_frame(report_dir, name, df):
+    if pa is not None:
+        file = f'{name}.feather'
+        feather.write_feather(pa.Table.from_pandas(df, preserve_index=True), os.path.join(report_dir, file))
+    else:
+        file = f'{name}.pkl'
+        df.to_pickle(os.path.join(report_dir, file))
+    return file
+
+
+def _read_frame(report_dir, file):
+    path = os.path.join(report_dir, file)
+    if file.endswith('.feather'):
+        return feather.read_table(path).to_pandas()
+    return pd.read_pickle(path)
+
+
+def write_report(report_dir, key, frames, values):
+    """Writes `frames` ({name: DataFrame}) and JSON serialisable `values` keyed by `key`."""
+    os.makedirs(report_dir, exist_ok=True)
+    previous = read_manifest(report_dir)
+
+    files = {name: _write_frame(report_dir, name, df) for name, df in frames.items()}
+    for file in set(previous["frames"].values()) - set(files.values()):
+        if os.path.exists(os.path.join(report_dir, file)):
+            os.remove(os.path.join(report_dir, file))
+
+    # the manifest goes last, so an interrupted build is never read as complete
+    with open(manifest_path(report_dir), 'w') as f:
+        json.dump({"key": key, "frames": files, "values": values}, f, indent=2, sort_keys=True)
+
+
+def load_report(report_dir=REPORT_DIR):
+    """Returns {name: frame or value} of the report in `report_dir`."""
+    manifest = read_manifest(report_dir)
+    if manifest["key"] is None:
+        raise FileNotFoundError(f"no report in {report_dir}, run analysis/build_report.py first")
+
+    report = dict(manifest["values"])
+    for name, file in manifest["frames"].items():
+        report[name] = _read_frame(report_dir, file)
+    return report
@@ -0,0 +1,241 @@
+import os
+import sys
+import glob
+import json
+import shlex
+import shutil
+import hashlib
+import argparse
+import subprocess
+import yaml
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from fingerprint import file_digest, is_unchanged, source_files
+
+# Runs the actions of project.yaml locally, in dependency order, skipping every
+# action whose inputs and code are unchanged since its outputs were produced:
+#
+#   python analysis/run_local.py                    # every action
+#   python analysis/run_local.py generate_plots     # one action and what it needs
+#
+# An action's key hashes its command, the contents of the outputs of the actions
+# it needs and its code (the script or notebook and the local modules it
+# imports, plus the study definition and codelists for cohort actions). Keys
+# and output fingerprints are kept in .stage_cache/. Actions whose needs are
+# done run concurrently. Without cohortextractor installed, generate_cohort
+# actions write dummy data with analysis/dummy_data.py instead.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECT = os.path.join(ROOT, 'project.yaml')
+CACHE_DIR = os.path.join(ROOT, '.stage_cache')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the project.yaml actions locally, skipping unchanged ones")
+    parser.add_argument('actions', nargs='*', help="actions to run with their needs, defaults to every action")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="actions run concurrently")
+    parser.add_argument('--force', action='store_true', help="run the actions even if they are unchanged")
+    parser.add_argument('--dry-run', action='store_true', help="only print what would run")
+    return parser.parse_args()
+
+
+def load_project(path=PROJECT):
+    with open(path) as f:
+        return yaml.safe_load(f)
+
+
+def required_actions(actions, targets):
+    """Returns `targets` and everything they transitively need."""
+    required = set()
+    pending = list(targets or actions)
+    while pending:
+        name = pending.pop()
+        if name not in actions:
+            raise KeyError(f"no action {name} in project.yaml")
+        if name not in required:
+            required.add(name)
+            pending.extend(actions[name].get('needs', []))
+    return required
+
+
+def output_patterns(action):
+    return [pattern for outputs in action.get('outputs', {}).values() for pattern in outputs.values()]
+
+
+def output_files(action):
+    return sorted({path for pattern in output_patterns(action)
+                   for path in glob.glob(os.path.join(ROOT, pattern)) if os.path.isfile(path)})
+
+
+def _cohort_command(args, population):
+    """cohortextractor generate_cohort arguments -> the equivalent dummy_data.py command."""
+    options = {}
+    for arg in args:
+        if '=' in arg and arg.startswith('--'):
+            key, value = arg.split('=', 1)
+            options[key] = value
+    pairs = [arg for arg in args if '=' not in arg]
+    for key, value in zip(pairs[::2], pairs[1::2]):
+        options[key] = value
+
+    study = options['--study-definition']
+    output_dir = options.get('--output-dir', 'output')
+    command = [sys.executable, 'analysis/dummy_data.py', '--study-definition', f'analysis/{study}.py',
+               '--population', str(population)]
+    if '--index-date-range' in options:
+        return command + ['--index-date-range', options['--index-date-range'], '--output-dir', output_dir]
+    return command + ['--output', os.path.join(output_dir, f'input{study[len("study_definition"):]}.csv')]
+
+
+def local_command(run, population):
+    """Translates the `run` of an action into a command for this machine."""
+    image, *args = shlex.split(run.replace('/workspace', ROOT))
+    if image.startswith('cohortextractor'):
+        if shutil.which('cohortextractor') is None:
+            return _cohort_command(args[1:], population)
+        return ['cohortextractor'] + args
+    if image.startswith('python') and args[0] == 'python':
+        return [sys.executable] + args[1:]
+    return args
+
+
+def code_files(command):
+    """Local files of `command` and the local modules they import, transitively."""
+    paths = [os.path.join(ROOT, arg) if not os.path.isabs(arg) else arg for arg in command[1:]]
+    files = set(source_files([path for path in paths if path.endswith(('.py', '.ipynb')) and os.path.isfile(path)]))
+
+    if 'dummy_data.py' in ' '.join(command) or 'generate_cohort' in command:
+        files.update(glob.glob(os.path.join(ROOT, 'analysis', 'study_definition*.py')))
+        files.update(glob.glob(os.path.join(ROOT, 'codelists', '**', '*.csv'), recursive=True))
+    return sorted(files)
+
+
+class StageCache:
+    """Keys and output fingerprints of the actions run so far, plus a digest cache
+    so large unchanged outputs are not re-hashed on every run."""
+
+    def __init__(self, directory=CACHE_DIR):
+        self.directory = directory
+        self.path = os.path.join(directory, 'state.json')
+        self.state = {"actions": {}, "digests": {}}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.state = json.load(f)
+
+    def digest(self, path):
+        stat = os.stat(path)
+        entry = self.state["digests"].get(path)
+        if entry is None or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            entry = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": file_digest(path)}
+            self.state["digests"][path] = entry
+        return entry["sha256"]
+
+    def fingerprint(self, path):
+        self.digest(path)
+        entry = self.state["digests"][path]
+        return {"path": os.path.normpath(path), "size": entry["size"], "mtime": entry["mtime"],
+                "sha256": entry["sha256"]}
+
+    def key(self, run, inputs):
+        digest = hashlib.sha256(run.encode())
+        for path in inputs:
+            digest.update(os.path.relpath(path, ROOT).encode())
+            digest.update(self.digest(path).encode())
+        return digest.hexdigest()
+
+    def is_current(self, name, key):
+        entry = self.state["actions"].get(name)
+        if entry is None or entry["key"] != key or not entry["outputs"]:
+            return False
+        return all(is_unchanged(path, fingerprint) for path, fingerprint in entry["outputs"].items())
+
+    def record(self, name, key, outputs):
+        self.state["actions"][name] = {"key": key, "outputs": {path: self.fingerprint(path) for path in outputs}}
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+
+
+def _run(name, command):
+    log_path = os.path.join(CACHE_DIR, 'logs', f'{name}.log')
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, 'w') as log:
+        try:
+            result = subprocess.run(command, cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+        except OSError as e:
+            # e.g. jupyter is not installed
+            log.write(f'{e}\n')
+            return 127, log_path
+    return result.returncode, log_path
+
+
+def run_actions(project, targets=None, workers=None, force=False, dry_run=False):
+    """
+    Runs the required actions as their needs complete, skipping the unchanged ones.
+    Returns {action: "skipped" | "ran" | "failed" | "blocked"}.
+    """
+    actions = project["actions"]
+    population = project.get("expectations", {}).get("population_size", 1000)
+    required = required_actions(actions, targets)
+    cache = StageCache()
+    status = {}
+    running = {}
+    keys = {}
+
+    def ready(name):
+        return name not in status and name not in running.values() and \
+            all(status.get(need) in ("skipped", "ran") for need in actions[name].get('needs', []))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers or 1)) as executor:
+        while len(status) < len(required):
+            for name in sorted(n for n in required if ready(n)):
+                command = local_command(actions[name]['run'], population)
+                inputs = code_files(command) + [path for need in actions[name].get('needs', [])
+                                                for path in output_files(actions[need])]
+                key = cache.key(actions[name]['run'], inputs)
+                if not force and cache.is_current(name, key):
+                    status[name] = "skipped"
+                    print(f"{name}: unchanged")
+                elif dry_run:
+                    status[name] = "ran"
+                    print(f"{name}: would run {shlex.join(command)}")
+                else:
+                    print(f"{name}: running")
+                    running[executor.submit(_run, name, command)] = name
+                    keys[name] = key
+
+            # an action whose needs failed can never run
+            for name in required:
+                if name not in status and name not in running.values() and \
+                        any(status.get(need) in ("failed", "blocked") for need in actions[name].get('needs', [])):
+                    status[name] = "blocked"
+                    print(f"{name}: blocked")
+
+            if not running:
+                if len(status) < len(required) and not any(ready(n) for n in required):
+                    raise RuntimeError("circular needs in project.yaml")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                returncode, log_path = future.result()
+                if returncode == 0:
+                    status[name] = "ran"
+                    cache.record(name, keys[name], output_files(actions[name]))
+                    print(f"{name}: done")
+                else:
+                    status[name] = "failed"
+                    print(f"{name}: failed with exit code {returncode}, see {log_path}")
+            cache.save()
+
+    return status
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    status = run_actions(load_project(), args.actions, args.workers, args.force, args.dry_run)
+    if any(s in ("failed", "blocked") for s in status.values()):
+        sys.exit(1)
@@ -0,0 +1,104 @@
+import os
+import json
+import hashlib
+import functools
+import pandas as pd
+
+from study_parser import load_study_variables, load_measures
+
+# Column dtypes of the cohort extracts and measure files, derived from the
+# variables and measures of the study definition rather than inferred by
+# pd.read_csv:
+#
+#   category  categorised_as / category expectations      -> category
+#   code      clinical event codes                          -> category of strings, never parsed as numbers
+#   flag      binary flags and the population               -> Int8
+#   int       integer variables (age, practice pseudo id)   -> Int16 / Int32
+#   count     measure numerators and denominators           -> Int32
+#   date      dates                                         -> parsed at read time
+#
+# Integer columns are read as nullable and turned into plain numpy integers
+# when they have no missing values.
+
+STUDY_DEFINITION = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'study_definition.py')
+
+DTYPES = {
+    "category": 'category',
+    "code": 'category',
+    "flag": 'Int8',
+    "age": 'Int16',
+    "int": 'Int32',
+    "count": 'Int32',
+    "float": 'float64',
+    "id": 'int64',
+}
+
+
+class Schema:
+    def __init__(self, kinds):
+        self.kinds = kinds
+
+    @property
+    def key(self):
+        """Hash of the schema, so caches written with another schema can be told apart."""
+        return hashlib.sha256(json.dumps(self.kinds, sort_keys=True).encode()).hexdigest()[:12]
+
+    def dtypes(self, columns):
+        """`dtype` argument for pd.read_csv of `columns`."""
+        return {c: DTYPES[self.kinds[c]] for c in columns if c in self.kinds and self.kinds[c] != "date"}
+
+    def date_columns(self, columns):
+        return [c for c in columns if self.kinds.get(c) == "date"]
+
+    def finalise(self, df):
+        """Turns nullable integer columns without missing values into numpy integers, in place."""
+        for column in df.columns:
+            dtype = df[column].dtype
+            if isinstance(dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_integer_dtype(dtype) \
+                    and not df[column].hasnans:
+                df[column] = df[column].astype(dtype.numpy_dtype)
+        return df
+
+
+def _variable_kind(variable):
+    if variable.name == 'population' or variable.returning == 'binary_flag':
+        return "flag"
+    if variable.returning == 'code':
+        return "code"
+    if variable.returning is not None and variable.returning.startswith('date'):
+        return "date"
+    if "category" in variable.expectations:
+        return "category"
+    if "int" in variable.expectations:
+        return "age" if variable.expectations["int"].get("distribution") == "population_ages" else "int"
+    # clinical event queries without a `returning` are binary flags
+    return "flag"
+
+
+@functools.lru_cache()
+def extract_schema(path=STUDY_DEFINITION):
+    """Schema of the cohort extracts generated from the study definition at `path`."""
+    _, variables = load_study_variables(path)
+    kinds = {v.name: _variable_kind(v) for v in variables}
+    kinds["patient_id"] = "id"
+    return Schema(kinds)
+
+
+@functools.lru_cache()
+def measure_schema(path=STUDY_DEFINITION):
+    """Schema of the measure files of the study definition at `path`."""
+    extract_kinds = extract_schema(path).kinds
+    kinds = {"value": "float", "date": "date"}
+    for measure in load_measures(path):
+        for column in measure.group_by or []:
+            kinds[column] = extract_kinds.get(column, "category")
+        kinds[measure.numerator] = "count"
+        kinds[measure.denominator] = "count"
+    return Schema(kinds)
+
+
+def schema_for(csv_path, study_definition=STUDY_DEFINITION):
+    """Measure files are named measure_<id>.csv, every other CSV is an extract."""
+    if os.path.basename(csv_path).startswith('measure_'):
+        return measure_schema(study_definition)
+    return extract_schema(study_definition)
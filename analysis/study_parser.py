@@ -0,0 +1,88 @@
+import ast
+
+# Reads definitions out of the study definition source without importing it,
+# so local scripts can use them without cohortextractor installed.
+
+STUDY_DEFINITION = 'analysis/study_definition.py'
+
+
+class Measure:
+    def __init__(self, id, numerator, denominator, group_by):
+        self.id = id
+        self.numerator = numerator
+        self.denominator = denominator
+        self.group_by = group_by
+
+
+def _parse(path):
+    with open(path) as f:
+        return ast.parse(f.read(), filename=path)
+
+
+def load_measures(path=STUDY_DEFINITION):
+    """Returns the `measures` list of the study definition at `path` as Measure objects."""
+    measures = []
+    for node in _parse(path).body:
+        if isinstance(node, ast.Assign) and any(
+                isinstance(target, ast.Name) and target.id == 'measures' for target in node.targets):
+            for call in node.value.elts:
+                kwargs = {keyword.arg: ast.literal_eval(keyword.value) for keyword in call.keywords}
+                measures.append(Measure(**kwargs))
+    return measures
+
+
+class Variable:
+    def __init__(self, name, function, returning, expectations):
+        self.name = name
+        self.function = function
+        self.returning = returning
+        self.expectations = expectations
+
+
+def _constants(tree):
+    """Module level names bound to literals, e.g. start_date = "2020-07-01"."""
+    constants = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            try:
+                constants[node.targets[0].id] = ast.literal_eval(node.value)
+            except ValueError:
+                pass
+    return constants
+
+
+def _evaluate(node, constants):
+    # expectations are literals, module constants and str() calls
+    expression = ast.Expression(node)
+    return eval(compile(expression, '<study definition>', 'eval'), {"__builtins__": {"str": str}}, constants)
+
+
+def load_study_variables(path=STUDY_DEFINITION):
+    """
+    Returns (default_expectations, variables) of the StudyDefinition at `path`,
+    where variables is a list of Variable objects for each column it returns.
+    The population is returned as a Variable named "population".
+    """
+    tree = _parse(path)
+    constants = _constants(tree)
+
+    study = None
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and getattr(node.func, 'id', None) == 'StudyDefinition':
+            study = node
+    if study is None:
+        raise ValueError(f"no StudyDefinition in {path}")
+
+    default_expectations = {}
+    variables = []
+    for keyword in study.keywords:
+        if keyword.arg == 'default_expectations':
+            default_expectations = _evaluate(keyword.value, constants)
+        elif isinstance(keyword.value, ast.Call):
+            kwargs = {k.arg: k.value for k in keyword.value.keywords}
+            expectations = _evaluate(kwargs['return_expectations'], constants) \
+                if 'return_expectations' in kwargs else {}
+            returning = _evaluate(kwargs['returning'], constants) if 'returning' in kwargs else None
+            variables.append(Variable(keyword.arg, keyword.value.func.attr, returning, expectations))
+
+    return default_expectations, variables
@@ -0,0 +1,159 @@
+import os
+import numpy as np
+import pandas as pd
+
+from study_parser import Measure
+from disclosure import redact_small_numbers
+
+# Sparse event code x month x dimension counts, e.g. how often each pulse
+# oximetry code was recorded in each region every month. The cube is computed
+# by generate_measures in the same pass over the extracts as the measures (as
+# one extra measure grouped by code and dimension per dimension) and stored as
+# index arrays into the codes, dates and dimension values, keeping only the
+# non-zero cells. The child table, code trends and regional comparisons are
+# slices of it.
+#
+# Counts are not redacted in the cube. Slices given `redact` suppress the
+# monthly cells with redact_small_numbers first, with secondary suppression on
+# both margins: within each code and month, whose totals the event code measure
+# publishes, and within each dimension value and month, whose totals the
+# measures by region or age band publish. Only the cells left are summed, so no
+# single suppressed cell can be recovered by differencing a slice against
+# either.
+
+CUBE_DIMENSIONS = ['region', 'practice', 'age_band']
+CELL_KEYS = ["values", "code", "date", "value", "events", "population"]
+CODE_COLUMN = 'had_pulse_ox_event_code'
+EVENT_COLUMN = 'had_pulse_ox'
+
+
+def cube_measures(dimensions=CUBE_DIMENSIONS, code_column=CODE_COLUMN, event_column=EVENT_COLUMN):
+    """The measures computed alongside the study measures to build the cube."""
+    return [Measure(id=f'usage_cube_{dimension}', numerator=event_column, denominator='population',
+                    group_by=[code_column, dimension])
+            for dimension in dimensions]
+
+
+def _value_array(values):
+    """Dimension values as a numpy array that saves without pickling: integers
+    with -1 for missing, or strings with '' for missing."""
+    values = pd.Series(values)
+    present = values.dropna().infer_objects()
+    if pd.api.types.is_numeric_dtype(present):
+        return values.fillna(-1).astype(np.int64).to_numpy()
+    return values.fillna('').astype(str).to_numpy(dtype=str)
+
+
+class UsageCube:
+    def __init__(self, codes, dates, dimensions):
+        self.codes = np.asarray(codes, dtype=str)
+        self.dates = list(dates)
+        # {dimension: {"values", "code", "date", "value", "events", "population"}}, one entry per non-zero cell
+        self.dimensions = dimensions
+
+    @classmethod
+    def from_measure_output(cls, output, dimensions=CUBE_DIMENSIONS, code_column=CODE_COLUMN,
+                            event_column=EVENT_COLUMN):
+        """Builds the cube from the `cube_measures` frames of generate_measures output."""
+        frames = {}
+        for dimension in dimensions:
+            df = output[f'usage_cube_{dimension}']
+            frames[dimension] = df[df[code_column].notna() & (df[event_column] > 0)]
+
+        codes = np.unique(np.concatenate([df[code_column].astype(str).to_numpy() for df in frames.values()]
+                                         or [np.array([], dtype=str)]))
+        dates = sorted(set().union(*[set(df['date']) for df in frames.values()]))
+
+        cells = {}
+        for dimension, df in frames.items():
+            values = _value_array(df[dimension])
+            uniques, value_index = np.unique(values, return_inverse=True)
+            cells[dimension] = {
+                "values": uniques,
+                "code": np.searchsorted(codes, df[code_column].astype(str).to_numpy()).astype(np.int32),
+                "date": np.searchsorted(dates, df['date'].to_numpy()).astype(np.int16),
+                "value": value_index.astype(np.int32),
+                "events": df[event_column].to_numpy(dtype=np.int64),
+                "population": df['population'].to_numpy(dtype=np.int64),
+            }
+        return cls(codes, dates, cells)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        dimensions = {}
+        for name in data['dimension_names'].tolist():
+            dimensions[name] = {key: data[f'{name}_{key}'] for key in CELL_KEYS}
+        return cls(data['codes'], data['dates'].tolist(), dimensions)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        arrays = {f'{name}_{key}': array for name, cells in self.dimensions.items() for key, array in cells.items()}
+        np.savez_compressed(path, codes=self.codes, dates=np.array(self.dates, dtype=str),
+                            dimension_names=np.array(list(self.dimensions), dtype=str), **arrays)
+
+    def frame(self, dimension):
+        """The cells of `dimension` as a long frame of code, date, dimension value, events and population."""
+        cells = self.dimensions[dimension]
+        return pd.DataFrame({
+            "code": self.codes[cells["code"]],
+            "date": pd.to_datetime(np.asarray(self.dates)[cells["date"]]),
+            dimension: cells["values"][cells["value"]],
+            "events": cells["events"],
+            "population": cells["population"],
+        })
+
+    def _events(self, dimension, redact):
+        """Events of the cells of `dimension`, nan where redact_small_numbers suppresses them."""
+        if redact is None:
+            return self.dimensions[dimension]["events"].astype(np.float64)
+        df = self.frame(dimension)
+        df['value'] = df['events'] / df['population']
+        measure = Measure(id=f'usage_cube_{dimension}', numerator='events', denominator='population',
+                          group_by=['code', dimension])
+        redact_small_numbers(df, redact, measure, margins=[['date', 'code'], ['date', dimension]])
+        return df['events'].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    def _sum(self, dimension, by_value, redact=None):
+        """
+        Sums events into a dense (code, date[, value]) array with one bincount.
+        With `redact`, suppressed cells are left out and sums without any cell left are nan.
+        """
+        cells = self.dimensions[dimension]
+        shape = (len(self.codes), len(self.dates)) + ((len(cells["values"]),) if by_value else ())
+        key = cells["code"].astype(np.int64) * len(self.dates) + cells["date"]
+        if by_value:
+            key = key * len(cells["values"]) + cells["value"]
+        events = self._events(dimension, redact)
+        shown = ~np.isnan(events)
+        sums = np.bincount(key[shown], weights=events[shown], minlength=int(np.prod(shape))).reshape(shape)
+        if redact is None:
+            return sums.astype(np.int64)
+        return np.where(np.bincount(key[shown], minlength=int(np.prod(shape))).reshape(shape) > 0, sums, np.nan)
+
+    def code_trend(self, dimension=None, redact=None):
+        """Events per code (columns) and month (rows). Every dimension sums to the same unredacted totals."""
+        totals = self._sum(dimension or next(iter(self.dimensions)), by_value=False, redact=redact)
+        df = pd.DataFrame(totals.T, index=pd.to_datetime(self.dates), columns=self.codes)
+        df.index.name = 'date'
+        return df
+
+    def code_totals(self, dimension=None, redact=None):
+        """Events per code over the whole period, from the same (redacted) cells as `by_dimension`."""
+        return self.code_trend(dimension, redact).sum(min_count=1)
+
+    def by_dimension(self, dimension, start=None, end=None, redact=None):
+        """Events per code (rows) and value of `dimension` (columns) over the months from `start` to `end`."""
+        totals = self._sum(dimension, by_value=True, redact=redact)
+        dates = np.asarray(self.dates)
+        keep = np.ones(len(dates), dtype=bool)
+        if start is not None:
+            keep &= dates >= start
+        if end is not None:
+            keep &= dates <= end
+        window = totals[:, keep, :]
+        sums = window.sum(axis=1) if redact is None else np.where(
+            np.isnan(window).all(axis=1), np.nan, np.nansum(window, axis=1))
+        df = pd.DataFrame(sums, index=self.codes, columns=self.dimensions[dimension]["values"])
+        df.index.name = 'code'
+        return df
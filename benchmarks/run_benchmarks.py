@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+import pandas as pd
+
+# Benchmarks each analysis stage and notebook utility on synthetic inputs at
+# several population sizes, recording wall time, peak RSS and rows per second:
+#
+#   python benchmarks/run_benchmarks.py --scales 10000 1000000
+#   python benchmarks/run_benchmarks.py --compare benchmarks/results/<old>.json benchmarks/results/<new>.json
+#
+# Every benchmark runs in its own spawned process so peak RSS is not shared
+# between them. baseline_rss_mb is that process's RSS after importing the
+# pipeline modules, before the benchmark loads its inputs.
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'analysis'))
+sys.path.append(os.path.join(ROOT, 'notebooks'))
+
+from generate_measures import generate_measures
+from get_patients_counts import get_input_files, get_patients_by_month
+from patient_store import write_month
+from patient_windows import PatientWindows
+from patient_months import PatientMonths
+from study_parser import load_measures, STUDY_DEFINITION
+
+MONTHS = pd.date_range('2020-07-01', '2021-01-01', freq='MS').strftime('%Y-%m-%d')
+CHUNKSIZE = 1_000_000
+
+BENCHMARKS = {}
+
+
+def benchmark(function):
+    """Registers a benchmark. It takes the synthetic data description and returns
+    (zero-argument callable to time, number of rows it processes)."""
+    BENCHMARKS[function.__name__] = function
+    return function
+
+
+def write_synthetic_data(directory, scale, seed=0):
+    """Writes a monthly extract of `scale` patients per month plus the measure files."""
+    rng = np.random.default_rng(seed)
+    input_dir = os.path.join(directory, 'output', 'measures')
+    os.makedirs(input_dir, exist_ok=True)
+
+    num_practices = max(10, scale // 2000)
+    for date in MONTHS:
+        had_pulse_ox = rng.random(scale) < 0.1
+        pd.DataFrame({
+            'age': rng.integers(0, 100, scale),
+            'age_band': rng.choice(['0-19', '20-29', '30-39', '40-49', '50-59', '60-69', '70-79', '80+'], scale),
+            'sex': rng.choice(['M', 'F'], scale),
+            'practice': rng.integers(1, num_practices + 1, scale),
+            'region': rng.choice(['North East', 'North West', 'London', 'South East'], scale),
+            'had_pulse_ox': had_pulse_ox.astype(int),
+            'had_pulse_ox_event_code': np.where(
+                had_pulse_ox, rng.choice(['1325191000000108', '1325201000000105'], scale), ''),
+            'population': 1,
+            'patient_id': rng.choice(scale * 3, scale, replace=False),
+        }).to_csv(os.path.join(input_dir, f'input_{date}.csv'), index=False)
+
+    measures = load_measures(os.path.join(ROOT, STUDY_DEFINITION))
+    output = generate_measures(get_input_files(input_dir), measures, CHUNKSIZE, workers=1)
+    for measure_id, df in output.items():
+        df.to_csv(os.path.join(input_dir, f'measure_{measure_id}.csv'), index=False)
+
+    return {"directory": directory, "input_dir": input_dir, "scale": scale,
+            "extract_rows": scale * len(MONTHS)}
+
+
+def load_measure(data, measure_id):
+    from measure_loader import load_measure_frame
+    measure = next(m for m in load_measures(os.path.join(ROOT, STUDY_DEFINITION)) if m.id == measure_id)
+    return load_measure_frame(measure, data["input_dir"], redact=None)
+
+
+@benchmark
+def stage_generate_measures(data):
+    measures = load_measures(os.path.join(ROOT, STUDY_DEFINITION))
+    files = get_input_files(data["input_dir"])
+    return lambda: generate_measures(files, measures, CHUNKSIZE, workers=1), data["extract_rows"]
+
+
+@benchmark
+def stage_get_patients_counts(data):
+    files = get_input_files(data["input_dir"])
+    store_dir = os.path.join(data["directory"], 'output', 'patient_count')
+
+    def run():
+        for date, (patients, _) in get_patients_by_month(files, 'had_pulse_ox', CHUNKSIZE, workers=1).items():
+            write_month(store_dir, date, patients)
+        PatientWindows.from_store(store_dir)
+        PatientMonths.from_store(store_dir)
+
+    return run, data["extract_rows"]
+
+
+@benchmark
+def stage_generate_plots(data):
+    from generate_plots import render_figures
+    frames = {m: load_measure(data, f'had_pulse_ox_{m}') for m in ['total', 'by_sex', 'by_region', 'by_age_band']}
+    os.makedirs('output/figures', exist_ok=True)
+    jobs = [((frames['total'], 'total', 'population_rates', 'had_pulse_ox'), {}),
+            ((frames['by_sex'], 'sex', 'sex_rates', 'rate'), dict(category='sex')),
+            ((frames['by_region'], 'region', 'region_rates', 'rate'), dict(category='region')),
+            ((frames['by_age_band'], 'age', 'age_rates', 'rate'), dict(category='age_band'))]
+    return lambda: render_figures(jobs, workers=1), sum(len(df) for df in frames.values())
+
+
+@benchmark
+def utility_load_measure_frames(data):
+    from measure_loader import load_measure_frames, clear_cache
+    measures = load_measures(os.path.join(ROOT, STUDY_DEFINITION))
+
+    def run():
+        # cold loads, the cache would otherwise answer every run after the first
+        clear_cache()
+        return load_measure_frames(measures, data["input_dir"])
+
+    rows = sum(len(pd.read_csv(os.path.join(data["input_dir"], f'measure_{m.id}.csv'), usecols=['date']))
+               for m in measures)
+    return run, rows
+
+
+@benchmark
+def utility_redact_small_numbers(data):
+    from utilities import redact_small_numbers
+    measures = load_measures(os.path.join(ROOT, STUDY_DEFINITION))
+    frames = [load_measure(data, m.id) for m in measures]
+    return lambda: redact_small_numbers(frames, 5, measures), sum(len(df) for df in frames)
+
+
+@benchmark
+def utility_get_percentiles(data):
+    from utilities import get_percentiles
+    df = load_measure(data, 'had_pulse_ox_practice_only')
+    return lambda: get_percentiles(df, period_column='date', column='rate'), len(df)
+
+
+@benchmark
+def utility_drop_irrelevant_practices(data):
+    from utilities import drop_irrelevant_practices
+    df = load_measure(data, 'had_pulse_ox_practice_only')
+    return lambda: drop_irrelevant_practices(df), len(df)
+
+
+@benchmark
+def utility_funnel_limits(data):
+    from utilities import calculate_rate, funnel_limits
+    df = load_measure(data, 'had_pulse_ox_practice_only')
+
+    def run():
+        calculate_rate(df, ci='wilson')
+        funnel_limits(df)
+
+    return run, len(df)
+
+
+@benchmark
+def utility_calculate_statistics_practices(data):
+    from utilities import WindowSummary
+    df = load_measure(data, 'had_pulse_ox_practice_only')
+    practice_df = pd.DataFrame({'practice': np.unique(df['practice'])})
+
+    def run():
+        # a fresh summary each time so the cache does not hide the work
+        summary = WindowSummary(df)
+        summary.practice_percentages('2021-01-01', len(practice_df))
+        summary.events('2021-01-01', 'had_pulse_ox')
+
+    return run, len(df)
+
+
+@benchmark
+def utility_calculate_statistics_demographics(data):
+    from utilities import calculate_statistics_demographics
+    df = load_measure(data, 'had_pulse_ox_by_region')
+    return lambda: calculate_statistics_demographics(df, 'region', '2021-01-01', 'had_pulse_ox'), len(df)
+
+
+@benchmark
+def utility_create_child_table(data):
+    from utilities import create_child_table, load_compiled_codelist
+    df = load_measure(data, 'had_pulse_ox_event_code')
+    codelist = load_compiled_codelist('pulse-oximetry', root=ROOT)
+    return lambda: create_child_table(df, codelist, 'code', 'term', 'had_pulse_ox'), len(df)
+
+
+def _peak_rss_mb():
+    """Peak RSS of this process only. On Linux ru_maxrss keeps the parent's peak
+    across fork and exec, so the VmHWM of the process's own memory is read there.
+    The stages are benchmarked with one worker, so there are no child processes."""
+    try:
+        with open('/proc/self/status') as f:
+            return next(int(line.split()[1]) for line in f if line.startswith('VmHWM:')) / 2 ** 10
+    except (OSError, StopIteration):
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        unit = 1 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 2 ** 20
+
+
+def _run_benchmark(name, data, queue):
+    os.chdir(data["directory"])
+    # the interpreter and the pipeline modules alone, before the benchmark's inputs are loaded
+    import utilities  # noqa: F401
+    baseline = _peak_rss_mb()
+    run, rows = BENCHMARKS[name](data)
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    queue.put({"benchmark": name, "scale": data["scale"], "rows": int(rows),
+               "wall_time_s": elapsed, "peak_rss_mb": _peak_rss_mb(), "baseline_rss_mb": baseline,
+               "rows_per_s": rows / elapsed if elapsed else None})
+
+
+def run_benchmark(name, data):
+    # spawned rather than forked, so the child's peak RSS does not start from
+    # the parent's, which holds the synthetic data and the measures it built
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_run_benchmark, args=(name, data, queue))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        return {"benchmark": name, "scale": data["scale"], "error": f"exit code {process.exitcode}"}
+    return queue.get()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(old_path, new_path):
+    """Prints the wall time and peak RSS ratios of `new_path` to `old_path`."""
+    with open(old_path) as f:
+        old = {(r["benchmark"], r["scale"]): r for r in json.load(f)["results"] if "error" not in r}
+    with open(new_path) as f:
+        new = {(r["benchmark"], r["scale"]): r for r in json.load(f)["results"] if "error" not in r}
+
+    print(f'{"benchmark":45} {"scale":>10} {"time":>8} {"rss":>8}')
+    for key in sorted(old.keys() & new.keys()):
+        time_ratio = new[key]["wall_time_s"] / old[key]["wall_time_s"]
+        rss_ratio = new[key]["peak_rss_mb"] / old[key]["peak_rss_mb"]
+        print(f'{key[0]:45} {key[1]:>10} {time_ratio:>7.2f}x {rss_ratio:>7.2f}x')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the analysis pipeline at scaled population sizes")
+    parser.add_argument('--scales', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help="patients per monthly extract")
+    parser.add_argument('--benchmarks', nargs='+', choices=sorted(BENCHMARKS), default=sorted(BENCHMARKS))
+    parser.add_argument('--output', default=None,
+                        help="results file, defaults to benchmarks/results/<commit>.json")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit()
+
+    commit = git_commit()
+    results = []
+    for scale in args.scales:
+        with tempfile.TemporaryDirectory() as directory:
+            data = write_synthetic_data(directory, scale)
+            for name in args.benchmarks:
+                result = run_benchmark(name, data)
+                results.append(result)
+                print(json.dumps(result))
+
+    output = args.output or os.path.join(ROOT, 'benchmarks', 'results', f'{commit}.json')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({"commit": commit, "python": platform.python_version(),
+                   "pandas": pd.__version__, "numpy": np.__version__,
+                   "cpu_count": os.cpu_count(), "results": results}, f, indent=2)
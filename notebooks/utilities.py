@@ -6,13 +6,28 @@ import json
 import datetime
 from dateutil.relativedelta import relativedelta
 import os
+import sys
+import hashlib
 
-# https://github.com/ebmdatalab/datalab-pandas/blob/master/ebmdatalab/charts.py#L20
-def add_percentiles(df, period_column=None, column=None, show_outer_percentiles=True):
-    """For each period in `period_column`, compute percentiles across that
-    range.
-    Adds `percentile` column.
-    """
+# shared pipeline modules live alongside the analysis scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'analysis'))
+
+from codelist_index import CodelistIndex
+from columnar_cache import load_csv, iter_csv
+from compile_codelists import load_compiled_codelist
+from disclosure import redact_small_numbers
+from patient_windows import PatientWindows
+from patient_months import PatientMonths
+from usage_cube import UsageCube
+from perf import timed
+from report_store import load_report
+from rates import calculate_rate, funnel_limits
+from measure_loader import load_measure_frame, load_measure_frames
+
+_percentiles_cache = {}
+
+
+def get_quantiles(show_outer_percentiles=True):
     deciles = np.arange(0.1, 1, 0.1)
     bottom_percentiles = np.arange(0.01, 0.1, 0.01)
     top_percentiles = np.arange(0.91, 1, 0.01)
@@ -20,37 +35,75 @@ def add_percentiles(df, period_column=None, column=None, show_outer_percentiles=
         quantiles = np.concatenate((deciles, bottom_percentiles, top_percentiles))
     else:
         quantiles = deciles
-    df = df.groupby(period_column)[column].quantile(quantiles).reset_index()
-    df = df.rename(index=str, columns={"level_1": "percentile"})
-    # create integer range of percentiles
-    df["percentile"] = df["percentile"].apply(lambda x: int(x * 100))
-    return df
+    return np.sort(quantiles)
 
 
-def to_datetime_sort(df):
-    df['date'] = pd.to_datetime(df['date'])
-    df = df.sort_values(by='date')
+def frame_fingerprint(df):
+    """Hash of the values of `df`, ignoring its index."""
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes()).hexdigest()
 
 
-def redact_small_numbers(df, n, m):
+@timed("percentiles")
+def get_percentiles(df, period_column=None, column=None, show_outer_percentiles=True, measure_id=None):
+    """For each period in `period_column`, compute percentiles of `column` across that
+    range. Each period is sorted once and every quantile is read from the sorted values
+    by linear interpolation, as in `DataFrame.quantile`.
+    Returns frame indexed by period with one column per integer percentile. Results are
+    cached by `measure_id` if given, together with a hash of the period and value
+    columns, so a reloaded or re-redacted frame is recomputed.
     """
-    Takes measures df and converts any row to nana where value of denominator or numerater in measure m equal to 
-    or below n
-    Returns df of same shape.
+    key = (measure_id, period_column, column, show_outer_percentiles)
+    if measure_id is not None:
+        fingerprint = frame_fingerprint(df[[period_column, column]])
+        cached = _percentiles_cache.get(key)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1]
+
+    quantiles = get_quantiles(show_outer_percentiles)
+
+    values = df[column].to_numpy(dtype=np.float64, na_value=np.nan)
+    keep = ~np.isnan(values)
+    codes, periods = pd.factorize(df[period_column][keep], sort=True)
+    values = values[keep]
+
+    order = np.lexsort((values, codes))
+    sorted_values = values[order]
+    counts = np.bincount(codes, minlength=len(periods))
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    positions = (counts[:, None] - 1) * quantiles[None, :]
+    lower = np.floor(positions).astype(np.int64)
+    upper = np.ceil(positions).astype(np.int64)
+    lower_values = sorted_values[starts[:, None] + lower]
+    upper_values = sorted_values[starts[:, None] + upper]
+    result = lower_values + (upper_values - lower_values) * (positions - lower)
+
+    percentiles = pd.DataFrame(result, index=pd.Index(periods, name=period_column),
+                               columns=np.rint(quantiles * 100).astype(int))
+    if measure_id is not None:
+        _percentiles_cache[key] = (fingerprint, percentiles)
+    return percentiles
+
+
+# https://github.com/ebmdatalab/datalab-pandas/blob/master/ebmdatalab/charts.py#L20
+def add_percentiles(df, period_column=None, column=None, show_outer_percentiles=True, measure_id=None):
+    """For each period in `period_column`, compute percentiles across that
+    range.
+    Adds `percentile` column.
     """
-    mask_n = df[m.numerator].isin(list(range(0, n+1)))
-    mask_d = df[m.denominator].isin(list(range(0, n+1)))
-    mask = mask_n | mask_d
-    df.loc[mask, :] = np.nan
+    df = get_percentiles(df, period_column, column, show_outer_percentiles, measure_id)
+    df = df.melt(ignore_index=False, var_name="percentile", value_name=column).reset_index()
     return df
 
 
-def calculate_rate(df, value_col='had_smr', population_col='population', rate_per=1000):
-    num_per_thousand = df[value_col]/(df[population_col]/rate_per)
-    df['rate'] = num_per_thousand
-
+@timed("parse_dates")
+def to_datetime_sort(df):
+    df['date'] = pd.to_datetime(df['date'])
+    df.sort_values(by='date', kind='stable', inplace=True)
+    df.reset_index(drop=True, inplace=True)
 
 
+@timed("plotting")
 def plot_measures(df, title, measure_id, column_to_plot, category=False, y_label='Rate per 1000', interactive=True):
 
     if interactive:
@@ -58,11 +111,9 @@ def plot_measures(df, title, measure_id, column_to_plot, category=False, y_label
         fig = go.Figure()
 
         if category:
-            for unique_category in df[category].unique():
-
-                df_subset = df[df[category] == unique_category]
+            for unique_category, df_subset in df.groupby(category, sort=False, dropna=False, observed=True):
                 fig.add_trace(go.Scatter(
-                    x=df_subset['date'], y=df_subset[column_to_plot], name=unique_category))
+                    x=df_subset['date'], y=df_subset[column_to_plot], name=str(unique_category)))
 
         else:
             fig.add_trace(go.Scatter(
@@ -113,11 +164,8 @@ def plot_measures(df, title, measure_id, column_to_plot, category=False, y_label
     else:
 
         if category:
-            for unique_category in df[category].unique():
-
-                df_subset = df[df[category] == unique_category]
-
-                plt.plot(df_subset['date'], df_subset[column_to_plot], marker='o')
+            for unique_category, df_subset in df.groupby(category, sort=False, dropna=False, observed=True):
+                plt.plot(df_subset['date'], df_subset[column_to_plot], marker='o', label=unique_category)
         else:
             plt.plot(df['date'], df[column_to_plot], marker='o')
 
@@ -127,7 +175,7 @@ def plot_measures(df, title, measure_id, column_to_plot, category=False, y_label
         plt.title(title)
 
         if category:
-            plt.legend(df[category].unique(), bbox_to_anchor=(
+            plt.legend(bbox_to_anchor=(
                 1.04, 1), loc="upper left")
 
         else:
@@ -143,19 +191,56 @@ def plot_measures(df, title, measure_id, column_to_plot, category=False, y_label
 
 
 
-def drop_irrelevant_practices(df):
-    #drop practices that do not use the code
-    mean_value_df = df.groupby("practice")["value"].mean().reset_index()
+def _practice_usage(practice, value):
+    """Returns (practices, sum of values, number of non-missing values) per practice.
+    Missing practices are ignored."""
+    codes, uniques = pd.factorize(practice)
+    value = value.to_numpy(dtype=np.float64, na_value=np.nan)
+    keep = (codes >= 0) & ~np.isnan(value)
+    sums = np.bincount(codes[keep], weights=value[keep], minlength=len(uniques))
+    counts = np.bincount(codes[keep], minlength=len(uniques))
+    return codes, np.asarray(uniques), sums, counts
+
+
+@timed("drop_irrelevant_practices")
+def drop_irrelevant_practices(df, outliers=False, value_col='had_pulse_ox', population_col='population'):
+    #drop practices that do not use the code, i.e. whose mean value is 0.
+    #the keep mask is built per row from one factorize and two bincounts
+    codes, _, sums, counts = _practice_usage(df['practice'], df['value'])
+    irrelevant = (counts > 0) & (sums == 0)
 
-    practices_to_drop = list(
-        mean_value_df['practice'][mean_value_df['value'] == 0])
+    keep = codes < 0
+    keep[~keep] = ~irrelevant[codes[~keep]]
 
     #drop
-    df = df[~df['practice'].isin(practices_to_drop)]
+    if not outliers:
+        return df[keep]
 
-    return df
+    #funnel plot limits and outlier flags of the remaining practices, against each month's pooled rate
+    return funnel_limits(df[keep].copy(), value_col, population_col)
+
+
+def iter_drop_irrelevant_practices(chunks):
+    """Streaming drop_irrelevant_practices over practice-partitioned chunks, i.e.
+    every row of a practice is in the same chunk. Yields the kept rows of each chunk."""
+    for chunk in chunks:
+        yield drop_irrelevant_practices(chunk)
 
 
+def iter_relevant_practices(csv_path, chunksize=1_000_000):
+    """Streaming drop_irrelevant_practices for a practice-level measure file that is
+    not partitioned by practice. The first pass over the file collects the usage of
+    each practice, the second yields the kept rows of each chunk, so only one chunk
+    and the per-practice totals are held in memory."""
+    usage = []
+    for chunk in iter_csv(csv_path, columns=['practice', 'value'], chunksize=chunksize):
+        _, practices, sums, counts = _practice_usage(chunk['practice'], chunk['value'])
+        usage.append(pd.DataFrame({'practice': practices, 'sum': sums, 'count': counts}))
+    usage = pd.concat(usage).groupby('practice').sum()
+    irrelevant = usage.index[(usage['count'] > 0) & (usage['sum'] == 0)].to_numpy()
+
+    for chunk in iter_csv(csv_path, chunksize=chunksize):
+        yield chunk[~np.isin(chunk['practice'].to_numpy(), irrelevant)]
 
 
 
@@ -165,18 +250,22 @@ def get_child_codes(df, measure):
     event_code_column = f'{measure}_event_code'
     event_column = f'{measure}'
 
-    counts = df.groupby(event_code_column)[event_column].sum()
+    counts = df.groupby(event_code_column, observed=True)[event_column].sum()
     code_dict = dict(counts)
 
     return code_dict
 
 
-def create_child_table(df, code_df, code_column, term_column, measure, nrows=5):
-    #pass in df from data_dict
-    #code df contains first digits and descriptions
+@timed("child_table")
+def create_child_table(df, code_df, code_column, term_column, measure, nrows=5, redact=None, dimension=None):
+    #pass in df from data_dict, or a UsageCube whose `dimension` cells are redacted at `redact` before summing
+    #code df contains first digits and descriptions, or is an already built CodelistIndex
 
     #get codes counts
-    code_dict = get_child_codes(df, measure)
+    if isinstance(df, UsageCube):
+        code_dict = dict(df.code_totals(dimension, redact))
+    else:
+        code_dict = get_child_codes(df, measure)
 
     #make df of events for each subcode
     df = pd.DataFrame.from_dict(
@@ -184,7 +273,7 @@ def create_child_table(df, code_df, code_column, term_column, measure, nrows=5):
     df[code_column] = df.index
 
     #convert events to events/thousand
-    df['Events (thousands)'] = df['Events'].apply(lambda x: x/1000)
+    df['Events (thousands)'] = df['Events'] / 1000
     df.drop(columns=['Events'])
 
     #order by events
@@ -192,92 +281,175 @@ def create_child_table(df, code_df, code_column, term_column, measure, nrows=5):
     df = df.iloc[:, [1, 0, 2]]
 
     #get description for each code
+    if not isinstance(code_df, CodelistIndex):
+        code_df = CodelistIndex(code_df, code_column, term_column)
+    df['Description'] = code_df.describe(df[code_column]).to_numpy()
 
-    def get_description(row):
-        code = row[code_column]
+    #return top n rows
+    return df.iloc[:nrows, :]
 
-        description = code_df[code_df[code_column]
-                              == code][term_column].values[0] if code in code_df[code_column].values else ""
 
-        return description
+def load_patient_windows(store_dir='../output/patient_count'):
+    path = os.path.join(store_dir, 'windows.npz')
+    if os.path.exists(path):
+        return PatientWindows.load(path)
+    return PatientWindows.from_store(store_dir)
 
-    df['Description'] = df.apply(
-        lambda row: get_description(row), axis=1)
 
-    #return top n rows
-    return df.iloc[:nrows, :]
+def load_usage_cube(measures_dir='../output/measures'):
+    """Event code x month x region/practice/age_band counts written by generate_measures."""
+    return UsageCube.load(os.path.join(measures_dir, 'usage_cube.npz'))
 
 
-def get_patients_counts(df, event_column, end_date):
-    f = open("output/patient_count.json")
-    num_patients = json.load(f)['num_patients']
-    dates = list(num_patients.keys())
+def load_patient_months(store_dir='../output/patient_count'):
+    """Per-patient bitmask of the months with an event, for longitudinal counts."""
+    path = os.path.join(store_dir, 'months.npz')
+    if os.path.exists(path):
+        return PatientMonths.load(path)
+    return PatientMonths.from_store(store_dir)
 
-    dates = sorted(dates)
 
-    def get_counts_from_dates_list(dates):
-        patients = np.concatenate([num_patients[date] for date in dates])
-        patients_total = len(np.unique(patients))
-        return patients_total
+def get_patients_counts(df, event_column, end_date, store_dir='../output/patient_count', approximate=False):
+    """
+    Number of distinct patients with an event over the whole study period, the
+    year before `end_date` and the 3 months before `end_date`. Any other window
+    can be queried with `load_patient_windows(store_dir).count(start, end)`.
+    """
+    windows = load_patient_windows(store_dir)
 
-    patients_total = get_counts_from_dates_list(dates)
+    year_before, months_3_before = get_window_cutoffs(end_date)
 
-    end_date = datetime.datetime.strptime(end_date, '%Y-%m-%d')
-    year_before = end_date - relativedelta(years=1)
-    dates_year = [i for i in dates if datetime.datetime.strptime(
-        i, '%Y-%m-%d') > year_before]
-    patients_year = get_counts_from_dates_list(dates_year)
+    # windows include months strictly after the cutoff
+    def start_after(cutoff):
+        return (cutoff + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
 
-    months_3_before = end_date - relativedelta(months=3)
-    dates_months_3 = [i for i in dates if datetime.datetime.strptime(
-        i, '%Y-%m-%d') > months_3_before]
-    patients_months_3 = get_counts_from_dates_list(dates_months_3)
+    patients_total = windows.count(approximate=approximate)
+    patients_year = windows.count(start=start_after(year_before), approximate=approximate)
+    patients_months_3 = windows.count(start=start_after(months_3_before), approximate=approximate)
 
     numbers_dict = {"total": patients_total,
                     "year": patients_year, "months_3": patients_months_3}
     return numbers_dict
     
 
-def get_number_practices(df, end_date):
-    
-    num_practices_total = len(np.unique(df['practice']))
-
+def get_window_cutoffs(end_date):
+    """Returns the (year before, 3 months before) cutoffs for `end_date`. Windows
+    contain the dates strictly after their cutoff."""
     end_date = datetime.datetime.strptime(
         end_date, '%Y-%m-%d')
 
-
     year_before = end_date - relativedelta(years=1)
     months_3_before = end_date - relativedelta(months=3)
-
-    df_subset_year = df[df['date'] > year_before]
-    num_practices_year = len(np.unique(df_subset_year['practice']))
-
-    df_subset_months_3 = df[df['date'] > months_3_before]
-    num_practices_months_3 = len(np.unique(df_subset_months_3['practice']))
-
-    numbers_dict = {"total": num_practices_total, "year": num_practices_year, "3_months": num_practices_months_3}
-    return numbers_dict
+    return year_before, months_3_before
 
 
-def get_number_events(df, events_column, end_date):
+class DateIndex:
+    """
+    Measure frame sorted by date, with window selection by binary search on the
+    sorted dates. Windows are positional slices of the frame (views rather than
+    boolean-mask copies). Frames not already sorted by `to_datetime_sort` are
+    sorted into a copy.
+    """
 
-    end_date = datetime.datetime.strptime(
-        end_date, '%Y-%m-%d')
+    def __init__(self, df, date_column='date'):
+        if not df[date_column].is_monotonic_increasing:
+            df = df.sort_values(by=date_column, kind='stable').reset_index(drop=True)
+        self.df = df
+        self.dates = df[date_column].to_numpy()
+
+    def position_after(self, cutoff):
+        """Position of the first row dated strictly after `cutoff`."""
+        return int(np.searchsorted(self.dates, np.datetime64(cutoff), side='right'))
+
+    def window(self, after=None):
+        """Rows dated strictly after `after` (all rows if None)."""
+        if after is None:
+            return self.df
+        return self.df.iloc[self.position_after(after):]
+
+    def window_positions(self, end_date):
+        """Start positions of the (total, year, 3 months) windows for `end_date`."""
+        year_before, months_3_before = get_window_cutoffs(end_date)
+        return 0, self.position_after(year_before), self.position_after(months_3_before)
+
+    def buckets(self, end_date):
+        """
+        Assigns each row to a window bucket relative to `end_date`: 0 for before the
+        last year, 1 for the last year but not the last 3 months, 2 for the last 3 months.
+        """
+        _, year, months_3 = self.window_positions(end_date)
+        buckets = np.zeros(len(self.dates), dtype=np.int8)
+        buckets[year:] = 1
+        buckets[months_3:] = 2
+        return buckets
+
+
+class WindowSummary:
+    """
+    Distinct practices and event sums of a measure frame over the whole study period,
+    the year before an end date and the 3 months before it. The frame is held in a
+    DateIndex, so each window is a suffix of the sorted rows: the last row position of
+    every practice and the cumulative event sums are computed once, and each window
+    is then answered by binary search and cached. Build it after the frame is final,
+    e.g. after redaction, and pass it to the functions below in place of the frame to
+    share that work between them; it is not updated if the frame changes.
+    """
 
-    year_before = end_date - relativedelta(years=1)
-    months_3_before = end_date - relativedelta(months=3)
+    def __init__(self, df, practice_column='practice'):
+        self.index = DateIndex(df)
+        self.practice_column = practice_column
+        self._last_positions = None
+        self._cumulative_events = {}
+        self._cache = {}
+
+    def practices(self, end_date):
+        key = ('practices', end_date)
+        if key not in self._cache:
+            if self._last_positions is None:
+                codes, uniques = pd.factorize(self.index.df[self.practice_column])
+                keep = codes >= 0
+                last_positions = np.full(len(uniques), -1, dtype=np.int64)
+                np.maximum.at(last_positions, codes[keep], np.flatnonzero(keep))
+                self._last_positions = np.sort(last_positions)
+
+            # a practice is in a window if its last row is inside it
+            counts = [len(self._last_positions) - int(np.searchsorted(self._last_positions, start))
+                      for start in self.index.window_positions(end_date)]
+            self._cache[key] = dict(zip(["total", "year", "months_3"], counts))
+        return self._cache[key]
+
+    def events(self, end_date, events_column):
+        key = ('events', end_date, events_column)
+        if key not in self._cache:
+            if events_column not in self._cumulative_events:
+                events = self.index.df[events_column].fillna(0).to_numpy()
+                self._cumulative_events[events_column] = np.concatenate(([0], np.cumsum(events)))
+            cumulative = self._cumulative_events[events_column]
+
+            sums = [cumulative[-1] - cumulative[start] for start in self.index.window_positions(end_date)]
+            self._cache[key] = dict(zip(["total", "year", "months_3"], sums))
+        return self._cache[key]
+
+    def practice_percentages(self, end_date, num_practices):
+        return {window: {"number": number, "percent": float(f'{((number/num_practices)*100):.2f}')}
+                for window, number in self.practices(end_date).items()}
+
+
+def get_window_summary(df):
+    """Returns `df` if it is already a WindowSummary, otherwise builds one for it."""
+    if isinstance(df, WindowSummary):
+        return df
+    return WindowSummary(df)
 
-    num_events_total = df[events_column].sum()
 
-    df_subset_year = df[df['date'] > year_before]
-    num_events_year = df_subset_year[events_column].sum()
+def get_number_practices(df, end_date):
+    numbers = get_window_summary(df).practices(end_date)
+    numbers_dict = {"total": numbers["total"], "year": numbers["year"], "3_months": numbers["months_3"]}
+    return numbers_dict
 
-    df_subset_months_3 = df[df['date'] > months_3_before]
-    num_events_months_3 = df_subset_months_3[events_column].sum()
 
-    numbers_dict = {"total": num_events_total,
-                    "year": num_events_year, "months_3": num_events_months_3}
-    return numbers_dict
+def get_number_events(df, events_column, end_date):
+    return dict(get_window_summary(df).events(end_date, events_column))
 
 
 def calculate_statistics_practices(df, practice_df, end_date):
@@ -285,83 +457,79 @@ def calculate_statistics_practices(df, practice_df, end_date):
     
     num_practices = len(np.unique(practice_df['practice']))
 
-
     # calculate number of unique practices and caluclate as % of total
-    practices_included_total = get_number_practices(df, end_date)['total']
-    practices_included_year = get_number_practices(df, end_date)['year']
-    practices_included_months_3 = get_number_practices(df, end_date)['3_months']
-
-
-    practices_included_percent_total = float(
-        f'{((practices_included_total/num_practices)*100):.2f}')
-    
-    practices_included_percent_year = float(
-        f'{((practices_included_year/num_practices)*100):.2f}')
-
-    practices_included_percent_months_3 = float(
-        f'{((practices_included_months_3/num_practices)*100):.2f}')
-
-
-    return {"total": {"number": practices_included_total, "percent": practices_included_percent_total}, "year": {"number": practices_included_year, "percent": practices_included_percent_year}, "months_3": {"number": practices_included_months_3, "percent": practices_included_percent_months_3}}
-    
-    practices_included_total, practices_included_percent_total, practices_included_months_3, practices_included_percent_months_3
+    return get_window_summary(df).practice_percentages(end_date, num_practices)
 
 
 def calculate_statistics_demographics(df, demographic_var, end_date, event_column):
+    """
+    Number of events in each category of `demographic_var` over the whole study
+    period, the year before `end_date` and the 3 months before `end_date`.
+    Every row is assigned to a window bucket once from the sorted DateIndex
+    (0: before the last year, 1: last year but not last 3 months, 2: last 3 months) and the events are
+    summed in one groupby over (category, bucket). The nested windows are then
+    cumulative sums over the buckets.
+    `demographic_var` may be a list of columns, which share the bucket assignment;
+    the result is then indexed by (variable, category).
+    """
 
-    end_date = datetime.datetime.strptime(
-        end_date, '%Y-%m-%d')
-
-    year_before = end_date - relativedelta(years=1)
-    months_3_before = end_date - relativedelta(months=3)
+    date_index = DateIndex(df)
+    df = date_index.df
+    bucket = date_index.buckets(end_date)
+    events = df[event_column]
 
-    categories = df[demographic_var].unique()
+    columns = {"total": "Total Study Period", "year": "Within Last Year", "months_3": "Within Last 3 Months"}
 
-    output_dict = {}
-    for category in categories:
-        df_subset_total = df[df[demographic_var] == category]
-        events_total = df_subset_total[event_column].sum()
-        
-        df_subset_year = df[df['date'] > year_before]
-        events_year = df_subset_year[event_column].sum()
+    def counts_by_category(variable):
+        counts = events.groupby([df[variable], bucket], sort=False, dropna=False, observed=True).sum()
+        counts = counts.unstack(fill_value=0).reindex(columns=[0, 1, 2], fill_value=0)
+        return pd.DataFrame({
+            columns["total"]: counts[0] + counts[1] + counts[2],
+            columns["year"]: counts[1] + counts[2],
+            columns["months_3"]: counts[2],
+        })
 
-        df_subset_months_3 = df[df['date'] > months_3_before]
-        events_months_3 = df_subset_months_3[event_column].sum()
+    if isinstance(demographic_var, str):
+        counts_df = counts_by_category(demographic_var)
+        counts_df.index.name = None
+        return counts_df
 
-        output_dict[category] = {"total": events_total, "year": events_year, "months_3": events_months_3}
-    
-    counts_df = pd.DataFrame.from_dict(output_dict, orient='index')
-    counts_df = counts_df.rename(columns={"total": "Total Study Period", "year": "Within Last Year", "months_3": "Within Last 3 Months"})
-    return counts_df
+    return pd.concat({variable: counts_by_category(variable) for variable in demographic_var})
 
 def interactive_deciles_chart(
     df,
     period_column=None,
     column=None,
     title="",
-    ylabel=""
+    ylabel="",
+    measure_id=None
 ):
     """period_column must be dates / datetimes
     """
 
-    df = add_percentiles(
+    percentiles = get_percentiles(
         df,
         period_column=period_column,
         column=column,
         show_outer_percentiles=False,
+        measure_id=measure_id,
     )
+    deciles_chart(percentiles, title=title, ylabel=ylabel)
 
-    fig = go.Figure()
 
-    
+@timed("plotting")
+def deciles_chart(percentiles, title="", ylabel=""):
+    """Draws a frame from `get_percentiles`, e.g. precomputed by analysis/build_report.py.
+    """
+
+    fig = go.Figure()
 
-    for percentile in np.unique(df['percentile']):
-        df_subset = df[df['percentile'] == percentile]
+    for percentile, values in percentiles.items():
         if percentile == 50:
-            fig.add_trace(go.Scatter(x=df_subset[period_column], y=df_subset[column], line={
+            fig.add_trace(go.Scatter(x=percentiles.index, y=values, line={
                           "color": "blue", "dash": "solid", "width": 1.2}, name="median"))
         else:
-            fig.add_trace(go.Scatter(x=df_subset[period_column], y=df_subset[column], line={
+            fig.add_trace(go.Scatter(x=percentiles.index, y=values, line={
                           "color": "blue", "dash": "dash", "width": 1}, name=f"decile {int(percentile/10)}"))
 
      # Set title
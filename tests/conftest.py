@@ -0,0 +1,7 @@
+import os
+import sys
+
+# the analysis modules import each other as top-level modules, as the scripts and the notebook do
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'analysis'))
+sys.path.append(os.path.join(ROOT, 'notebooks'))
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+from disclosure import redact_small_numbers
+from study_parser import Measure
+
+BY_REGION = Measure(id='by_region', numerator='had_pulse_ox', denominator='population', group_by=['region'])
+TOTAL = Measure(id='total', numerator='had_pulse_ox', denominator='population', group_by=None)
+
+
+def measure_frame(rows, columns):
+    df = pd.DataFrame(rows, columns=columns)
+    df['value'] = df['had_pulse_ox'] / df['population']
+    return df
+
+
+def suppressed(df):
+    return df['had_pulse_ox'].isna().tolist()
+
+
+def test_small_numerators_and_denominators_are_suppressed():
+    df = measure_frame([(5, 100, '2020-07-01'), (6, 100, '2020-08-01'), (10, 4, '2020-09-01')],
+                       ['had_pulse_ox', 'population', 'date'])
+
+    redact_small_numbers(df, 5, TOTAL)
+
+    assert suppressed(df) == [True, False, True]
+    assert df.loc[[0, 2], ['population', 'value']].isna().all().all()
+
+
+def test_a_single_suppressed_group_suppresses_the_next_smallest_on_its_date():
+    df = measure_frame([
+        ('North', 3, 100, '2020-07-01'),
+        ('South', 40, 100, '2020-07-01'),
+        ('London', 50, 100, '2020-07-01'),
+        # two groups suppressed already, nothing more to do
+        ('North', 2, 100, '2020-08-01'),
+        ('South', 4, 100, '2020-08-01'),
+        ('London', 50, 100, '2020-08-01'),
+        # nothing suppressed
+        ('North', 20, 100, '2020-09-01'),
+        ('South', 40, 100, '2020-09-01'),
+    ], ['region', 'had_pulse_ox', 'population', 'date'])
+
+    redact_small_numbers(df, 5, BY_REGION)
+
+    assert suppressed(df) == [True, True, False, True, True, False, False, False]
+
+
+def test_secondary_suppression_is_within_the_leading_groups_of_each_date():
+    measure = Measure(id='by_code_region', numerator='events', denominator='population', group_by=['code', 'region'])
+    df = pd.DataFrame([
+        ('A', 'North', 3, 3, '2020-07-01'),
+        ('A', 'South', 40, 40, '2020-07-01'),
+        ('A', 'London', 50, 50, '2020-07-01'),
+        ('B', 'North', 20, 20, '2020-07-01'),
+        ('B', 'South', 30, 30, '2020-07-01'),
+    ], columns=['code', 'region', 'events', 'population', 'date'])
+    df['value'] = 1.0
+
+    redact_small_numbers(df, 5, measure)
+
+    # code A's total is published, so its smallest other region goes too; code B is untouched
+    assert df['events'].isna().tolist() == [True, True, False, False, False]
+
+
+def test_rounding_recalculates_the_value():
+    df = measure_frame([(12, 98, '2020-07-01')], ['had_pulse_ox', 'population', 'date'])
+
+    redact_small_numbers(df, 5, TOTAL, rounding=5)
+
+    assert df.loc[0, 'had_pulse_ox'] == 10
+    assert df.loc[0, 'population'] == 100
+    assert np.isclose(df.loc[0, 'value'], 0.1)
+
+
+def test_secondary_suppression_skips_groups_already_missing():
+    df = measure_frame([('a', 3, 100, '2020-07-01'), ('b', np.nan, 100, '2020-07-01')],
+                       ['region', 'had_pulse_ox', 'population', 'date'])
+
+    redact_small_numbers(df, 5, BY_REGION)
+
+    assert suppressed(df) == [True, True]
+    assert df.loc[1, 'population'] == 100
@@ -0,0 +1,88 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from columnar_cache import load_csv
+from generate_measures import calculate_measures, generate_measures
+from get_patients_counts import get_input_files
+from study_parser import load_measures, Measure, STUDY_DEFINITION
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MEASURES = load_measures(os.path.join(ROOT, STUDY_DEFINITION))
+DATES = ['2020-07-01', '2020-08-01', '2020-09-01']
+
+
+def make_extract(rng, size):
+    """An extract with the study definition's columns, including missing group values."""
+    df = pd.DataFrame({
+        'population': 1,
+        'age_band': rng.choice(['0-19', '20-29', '80+', None], size),
+        'sex': rng.choice(['F', 'M'], size),
+        'practice': rng.integers(0, 20, size),
+        'region': rng.choice(['London', 'North East', 'South West', None], size),
+        'had_pulse_ox': rng.integers(0, 2, size),
+        'had_pulse_ox_event_code': rng.choice(['1325191000000108', '1325201000000105', None], size),
+    })
+    df['patient_id'] = np.arange(size)
+    return df
+
+
+def expected(df, measure):
+    """The measure with a plain groupby, as cohortextractor calculates it."""
+    columns = [measure.numerator, measure.denominator]
+    if not measure.group_by:
+        return df[columns].sum().to_frame().T
+    return df.groupby(measure.group_by, dropna=False)[columns].sum().reset_index()
+
+
+def assert_same_measure(actual, expected, measure):
+    keys = (measure.group_by or []) + (['date'] if 'date' in expected else [])
+    columns = keys + [measure.numerator, measure.denominator]
+    # missing groups compare equal as strings
+    actual = actual[columns].astype({key: str for key in keys}).sort_values(keys or columns)
+    expected = expected[columns].astype({key: str for key in keys}).sort_values(keys or columns)
+    pd.testing.assert_frame_equal(actual.reset_index(drop=True), expected.reset_index(drop=True),
+                                  check_dtype=False)
+
+
+@pytest.mark.parametrize('measure', MEASURES, ids=lambda m: m.id)
+def test_calculate_measures_matches_groupby_across_chunks(measure):
+    df = make_extract(np.random.default_rng(0), 5000)
+    chunks = [df.iloc[i:i + 700] for i in range(0, len(df), 700)]
+
+    result = calculate_measures(chunks, [measure])[measure.id]
+    result = result.rename(columns={'numerator': measure.numerator, 'denominator': measure.denominator})
+
+    assert_same_measure(result, expected(df, measure), measure)
+
+
+def test_calculate_measures_without_denominator_column_counts_rows():
+    df = make_extract(np.random.default_rng(1), 1000).drop(columns='population')
+    measure = Measure(id='m', numerator='had_pulse_ox', denominator='population', group_by=['sex'])
+
+    result = calculate_measures([df], [measure])['m']
+
+    assert result.set_index('sex')['denominator'].to_dict() == df['sex'].value_counts().to_dict()
+
+
+def test_generate_measures_matches_groupby_of_each_extract(tmp_path):
+    rng = np.random.default_rng(2)
+    extracts = {}
+    for date in DATES:
+        path = tmp_path / f'input_{date}.csv'
+        make_extract(rng, 3000).to_csv(path, index=False)
+        # compare against the extract as the pipeline reads it, typed by the schema
+        extracts[date] = load_csv(str(path))
+
+    output = generate_measures(get_input_files(str(tmp_path)), MEASURES, chunksize=1000, workers=1)
+
+    for measure in MEASURES:
+        frames = []
+        for date, df in extracts.items():
+            frame = expected(df, measure)
+            frame['date'] = date
+            frames.append(frame)
+        result = output[measure.id]
+        assert_same_measure(result, pd.concat(frames, ignore_index=True), measure)
+        np.testing.assert_allclose(result['value'], result[measure.numerator] / result[measure.denominator])
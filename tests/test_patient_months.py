@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from patient_store import write_month
+from patient_months import PatientMonths
+
+DATES = ['2020-07-01', '2020-08-01', '2020-09-01', '2020-10-01', '2020-11-01', '2020-12-01', '2021-01-01']
+
+
+@pytest.fixture
+def store(tmp_path):
+    rng = np.random.default_rng(0)
+    months = {}
+    for date in DATES[:-1]:
+        months[date] = set(rng.choice(2000, size=int(rng.integers(0, 800)), replace=False).tolist())
+        write_month(str(tmp_path), date, list(months[date]))
+    # a month without events
+    months[DATES[-1]] = set()
+    write_month(str(tmp_path), DATES[-1], [])
+    return str(tmp_path), months
+
+
+def in_window(months, start=None, end=None):
+    return {date: patients for date, patients in months.items()
+            if (start is None or date >= start) and (end is None or date <= end)}
+
+
+def months_per_patient(months):
+    counts = {}
+    for patients in months.values():
+        for patient in patients:
+            counts[patient] = counts.get(patient, 0) + 1
+    return counts
+
+
+def test_count_matches_union_of_every_window(store):
+    store_dir, months = store
+    index = PatientMonths.from_store(store_dir)
+
+    for i, start in enumerate(DATES):
+        for end in DATES[i:]:
+            expected = len(set().union(*in_window(months, start, end).values()))
+            assert index.count(start, end) == expected, (start, end)
+    assert index.count() == len(set().union(*months.values()))
+
+
+def test_monitored_in_at_least(store):
+    store_dir, months = store
+    index = PatientMonths.from_store(store_dir)
+
+    for start, end in [(None, None), ('2020-08-01', '2020-11-01')]:
+        counts = months_per_patient(in_window(months, start, end))
+        for k in range(1, len(DATES) + 1):
+            expected = sum(1 for count in counts.values() if count >= k)
+            assert index.monitored_in_at_least(k, start, end) == expected, (start, end, k)
+
+
+def test_first_month(store):
+    store_dir, months = store
+    index = PatientMonths.from_store(store_dir)
+
+    first = dict(zip(index.patients.tolist(), index.first_month().tolist()))
+    for patient, month in first.items():
+        assert patient in months[DATES[month]]
+        assert not any(patient in months[date] for date in DATES[:month])
+
+
+def test_new_and_returning(store):
+    store_dir, months = store
+    index = PatientMonths.from_store(store_dir)
+
+    result = index.new_and_returning()
+    seen = set()
+    for date in DATES:
+        assert result.loc[date, 'new'] == len(months[date] - seen)
+        assert result.loc[date, 'returning'] == len(months[date] & seen)
+        seen |= months[date]
+
+
+def test_saved_index_gives_the_same_counts(store, tmp_path):
+    store_dir, months = store
+    path = str(tmp_path / 'months.npz')
+    PatientMonths.from_store(store_dir).save(path)
+
+    loaded = PatientMonths.load(path)
+
+    assert loaded.count('2020-09-01') == len(set().union(*in_window(months, '2020-09-01').values()))
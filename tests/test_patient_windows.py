@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from patient_store import write_month
+from patient_windows import PatientWindows
+
+DATES = ['2020-07-01', '2020-08-01', '2020-09-01', '2020-10-01', '2020-11-01', '2020-12-01']
+
+
+@pytest.fixture
+def store(tmp_path):
+    rng = np.random.default_rng(0)
+    months = {}
+    for date in DATES:
+        months[date] = set(rng.choice(5000, size=int(rng.integers(0, 1500)), replace=False).tolist())
+        write_month(str(tmp_path), date, list(months[date]))
+    # a month without events
+    months['2021-01-01'] = set()
+    write_month(str(tmp_path), '2021-01-01', [])
+    return str(tmp_path), months
+
+
+def brute_force(months, start, end):
+    return len(set().union(*[patients for date, patients in months.items()
+                             if (start is None or date >= start) and (end is None or date <= end)]))
+
+
+def test_count_matches_union_of_every_window(store):
+    store_dir, months = store
+    windows = PatientWindows.from_store(store_dir)
+    dates = sorted(months)
+
+    for i, start in enumerate(dates):
+        for end in dates[i:]:
+            assert windows.count(start, end) == brute_force(months, start, end), (start, end)
+
+    assert windows.count() == brute_force(months, None, None)
+    assert windows.count(start=dates[2]) == brute_force(months, dates[2], None)
+    assert windows.count(end=dates[2]) == brute_force(months, None, dates[2])
+
+
+def test_count_of_empty_or_reversed_window_is_zero(store):
+    store_dir, _ = store
+    windows = PatientWindows.from_store(store_dir)
+
+    assert windows.count('2020-09-01', '2020-08-01') == 0
+    assert windows.count('2022-01-01') == 0
+
+
+def test_saved_windows_give_the_same_counts(store, tmp_path):
+    store_dir, months = store
+    windows = PatientWindows.from_store(store_dir)
+    path = str(tmp_path / 'windows.npz')
+    windows.save(path)
+
+    loaded = PatientWindows.load(path)
+
+    assert loaded.count('2020-08-01', '2020-11-01') == brute_force(months, '2020-08-01', '2020-11-01')
+
+
+def test_approximate_count_is_within_the_sketch_error(store):
+    store_dir, months = store
+    windows = PatientWindows.from_store(store_dir)
+
+    exact = brute_force(months, None, None)
+    assert abs(windows.count(approximate=True) - exact) <= 4 * windows.error * exact
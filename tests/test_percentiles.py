@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+from utilities import get_percentiles, get_quantiles
+
+
+def practice_rates(rng, periods=6, practices=57):
+    df = pd.DataFrame({
+        'date': np.repeat(pd.date_range('2020-07-01', periods=periods, freq='MS'), practices),
+        'rate': rng.gamma(2, 10, periods * practices),
+    })
+    # redacted practices are ignored
+    df.loc[rng.random(len(df)) < 0.1, 'rate'] = np.nan
+    return df.sample(frac=1, random_state=0)
+
+
+def test_percentiles_match_groupby_quantile():
+    df = practice_rates(np.random.default_rng(0))
+
+    for outer in [False, True]:
+        quantiles = get_quantiles(outer)
+        expected = df.groupby('date')['rate'].quantile(quantiles).unstack()
+        expected.columns = np.rint(quantiles * 100).astype(int)
+
+        result = get_percentiles(df, period_column='date', column='rate', show_outer_percentiles=outer)
+
+        pd.testing.assert_frame_equal(result, expected, check_names=False)
+
+
+def test_cache_misses_when_the_frame_changes():
+    df = practice_rates(np.random.default_rng(1))
+    first = get_percentiles(df, period_column='date', column='rate', measure_id='test_cache')
+
+    assert get_percentiles(df.copy(), period_column='date', column='rate', measure_id='test_cache') is first
+
+    df['rate'] = df['rate'] * 2
+    second = get_percentiles(df, period_column='date', column='rate', measure_id='test_cache')
+
+    assert second is not first
+    pd.testing.assert_frame_equal(second, first * 2)
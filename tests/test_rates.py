@@ -0,0 +1,101 @@
+import math
+import numpy as np
+import pandas as pd
+import pytest
+
+from rates import calculate_rate, funnel_limits, poisson_interval, wilson_interval, Z_95, Z_998
+
+
+def test_wilson_interval_reference_values():
+    # Newcombe (1998), 95% intervals, including 0 events and events == population
+    lower, upper = wilson_interval([10, 0, 100], [100, 100, 100])
+
+    np.testing.assert_allclose(lower, [0.0552, 0, 0.9630], atol=1e-4)
+    np.testing.assert_allclose(upper, [0.1744, 0.0370, 1], atol=1e-4)
+
+
+def test_poisson_interval_is_close_to_the_exact_interval():
+    # exact (Garwood) 95% intervals; Byar's approximation is within 1%
+    lower, upper = poisson_interval([0, 10, 100])
+
+    assert lower[0] == 0
+    np.testing.assert_allclose(lower[1:], [4.795, 81.36], rtol=0.01)
+    np.testing.assert_allclose(upper, [3.689, 18.39, 121.63], rtol=0.01)
+
+
+def wilson_scalar(events, population, z):
+    p = events / population
+    denominator = 1 + z ** 2 / population
+    centre = (p + z ** 2 / (2 * population)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / population + z ** 2 / (4 * population ** 2)) / denominator
+    return max(centre - half_width, 0), min(centre + half_width, 1)
+
+
+def measure_frame(rng, periods=4, groups=30):
+    population = rng.integers(1, 5000, periods * groups)
+    return pd.DataFrame({
+        'date': np.repeat(pd.date_range('2020-07-01', periods=periods, freq='MS'), groups),
+        'practice': np.tile(np.arange(groups), periods),
+        'had_pulse_ox': rng.binomial(population, rng.uniform(0, 0.2, periods * groups)),
+        'population': population,
+    })
+
+
+def test_calculate_rate_matches_a_loop_over_rows():
+    df = measure_frame(np.random.default_rng(0))
+
+    calculate_rate(df, ci='wilson')
+
+    for row in df.itertuples():
+        lower, upper = wilson_scalar(row.had_pulse_ox, row.population, Z_95)
+        assert row.rate == pytest.approx(1000 * row.had_pulse_ox / row.population)
+        assert row.rate_lower == pytest.approx(1000 * lower)
+        assert row.rate_upper == pytest.approx(1000 * upper)
+
+
+def test_calculate_rate_rejects_unknown_intervals():
+    with pytest.raises(ValueError):
+        calculate_rate(measure_frame(np.random.default_rng(0)), ci='exact')
+
+
+def test_funnel_limits_match_a_loop_over_periods():
+    df = measure_frame(np.random.default_rng(1))
+    # a redacted row is left out of the pooled proportion and never flagged
+    df.loc[3, 'had_pulse_ox'] = np.nan
+
+    funnel_limits(df)
+
+    for _, period in df.groupby('date'):
+        shown = period.dropna(subset=['had_pulse_ox'])
+        target = shown['had_pulse_ox'].sum() / shown['population'].sum()
+        for row in period.itertuples():
+            se = math.sqrt(target * (1 - target) / row.population)
+            assert row.target == pytest.approx(1000 * target)
+            assert row.lower_95 == pytest.approx(1000 * max(target - Z_95 * se, 0))
+            assert row.upper_998 == pytest.approx(1000 * min(target + Z_998 * se, 1))
+
+            observed = row.had_pulse_ox / row.population
+            expected = 1 if observed > target + Z_998 * se else -1 if observed < target - Z_998 * se else 0
+            assert row.outlier == expected
+
+    assert df.loc[3, 'outlier'] == 0
+
+
+def test_funnel_limits_flag_outliers():
+    df = pd.DataFrame({'date': ['2020-07-01'] * 4, 'had_pulse_ox': [100, 100, 100, 400],
+                       'population': [1000, 1000, 1000, 1000]})
+
+    funnel_limits(df)
+
+    assert df['outlier'].tolist() == [-1, -1, -1, 1]
+
+
+def test_funnel_limits_at_zero_and_full_proportions():
+    df = pd.DataFrame({'date': ['2020-07-01', '2020-07-01', '2020-08-01'], 'had_pulse_ox': [0, 0, 50],
+                       'population': [100, 200, 50]})
+
+    funnel_limits(df)
+
+    assert df['target'].tolist() == [0, 0, 1000]
+    assert df['lower_998'].tolist() == df['upper_998'].tolist() == [0, 0, 1000]
+    assert df['outlier'].tolist() == [0, 0, 0]
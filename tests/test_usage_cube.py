@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from generate_measures import generate_measures
+from get_patients_counts import get_input_files
+from usage_cube import UsageCube, cube_measures, CUBE_DIMENSIONS
+
+DATES = ['2020-07-01', '2020-08-01', '2020-09-01']
+CODES = ['1325191000000108', '1325201000000105', '1325211000000107']
+REGIONS = ['London', 'North East', 'South West']
+
+
+def make_extract(rng, size):
+    return pd.DataFrame({
+        'population': 1,
+        'age_band': rng.choice(['0-19', '20-29', '80+', None], size),
+        'practice': rng.integers(0, 20, size),
+        'region': rng.choice(REGIONS + [None], size),
+        'had_pulse_ox': rng.integers(0, 2, size),
+        'had_pulse_ox_event_code': rng.choice(CODES + [None], size),
+        'patient_id': np.arange(size),
+    })
+
+
+@pytest.fixture
+def extracts(tmp_path):
+    rng = np.random.default_rng(0)
+    frames = {}
+    for date in DATES:
+        frames[date] = make_extract(rng, 3000)
+        frames[date].to_csv(tmp_path / f'input_{date}.csv', index=False)
+    output = generate_measures(get_input_files(str(tmp_path)), cube_measures(), chunksize=1000, workers=1)
+    events = pd.concat([df.assign(date=date) for date, df in frames.items()], ignore_index=True)
+    events = events[(events['had_pulse_ox'] > 0) & events['had_pulse_ox_event_code'].notna()]
+    return UsageCube.from_measure_output(output), events
+
+
+@pytest.mark.parametrize('dimension', CUBE_DIMENSIONS)
+def test_by_dimension_matches_groupby(extracts, dimension):
+    cube, events = extracts
+    values = events[dimension].fillna(-1 if dimension == 'practice' else '')
+
+    expected = events.groupby(['had_pulse_ox_event_code', values])['had_pulse_ox'].sum().unstack(fill_value=0)
+    actual = cube.by_dimension(dimension)
+
+    pd.testing.assert_frame_equal(actual.loc[expected.index, expected.columns], expected,
+                                  check_names=False, check_dtype=False)
+    assert actual.to_numpy().sum() == events['had_pulse_ox'].sum()
+
+
+def test_by_dimension_window_matches_groupby(extracts):
+    cube, events = extracts
+    window = events[events['date'].between('2020-08-01', '2020-09-01')]
+
+    expected = window.groupby(['had_pulse_ox_event_code', 'region'])['had_pulse_ox'].sum().unstack(fill_value=0)
+    actual = cube.by_dimension('region', start='2020-08-01', end='2020-09-01')
+
+    pd.testing.assert_frame_equal(actual.loc[expected.index, expected.columns], expected,
+                                  check_names=False, check_dtype=False)
+
+
+def test_code_trend_and_totals_match_groupby(extracts):
+    cube, events = extracts
+
+    expected = events.groupby(['date', 'had_pulse_ox_event_code'])['had_pulse_ox'].sum().unstack(fill_value=0)
+    expected.index = pd.to_datetime(expected.index)
+    for dimension in CUBE_DIMENSIONS:
+        actual = cube.code_trend(dimension)
+        pd.testing.assert_frame_equal(actual[expected.columns], expected, check_names=False, check_dtype=False)
+    assert cube.code_totals().to_dict() == expected.sum().to_dict()
+
+
+def test_save_and_load_keep_the_cells(extracts, tmp_path):
+    cube, _ = extracts
+    path = str(tmp_path / 'usage_cube.npz')
+    cube.save(path)
+
+    loaded = UsageCube.load(path)
+
+    pd.testing.assert_frame_equal(loaded.by_dimension('region', redact=5), cube.by_dimension('region', redact=5))
+
+
+def cube_of(cells):
+    """A cube of one region dimension from (code, region, date, events) cells."""
+    df = pd.DataFrame(cells, columns=['had_pulse_ox_event_code', 'region', 'date', 'had_pulse_ox'])
+    df['population'] = df['had_pulse_ox']
+    return UsageCube.from_measure_output({'usage_cube_region': df}, ['region'])
+
+
+def test_small_count_cannot_be_recovered_from_the_region_total():
+    cube = cube_of([('A', 'North', '2020-07-01', 100), ('B', 'North', '2020-07-01', 80),
+                    ('C', 'North', '2020-07-01', 3), ('C', 'South', '2020-07-01', 50),
+                    ('C', 'London', '2020-07-01', 60), ('B', 'South', '2020-07-01', 40)])
+
+    table = cube.by_dimension('region', redact=5)
+    north_total = cube.by_dimension('region')['North'].sum()
+
+    assert np.isnan(table.loc['C', 'North'])
+    assert north_total - table['North'].sum() > 5
+
+
+def test_published_margins_never_hide_a_single_cell():
+    rng = np.random.default_rng(1)
+    codes, regions = list('ABCDEF'), list('NSELW')
+    cells = [(code, region, date, int(rng.choice([1, 2, 4, 7, 20, 90])))
+             for code in codes for region in regions for date in DATES if rng.random() < 0.8]
+    cube = cube_of(cells)
+
+    for date in DATES:
+        true = cube.by_dimension('region', start=date, end=date)
+        shown = cube.by_dimension('region', start=date, end=date, redact=5)
+        hidden = shown.isna() & (true > 0)
+
+        assert (shown.fillna(6) > 5).all().all()
+        # the month's code totals (rows) and region totals (columns) are published, so
+        # each hides none or several cells, and their difference is never a single count
+        assert not (hidden.sum(axis=1) == 1).any()
+        assert not (hidden.sum(axis=0) == 1).any()
+
+    # the child table totals are the row sums of the region table
+    pd.testing.assert_series_equal(cube.code_totals('region', redact=5),
+                                   cube.by_dimension('region', redact=5).sum(axis=1, min_count=1),
+                                   check_names=False)